@@ -1,9 +1,14 @@
 import streamlit as st
-from src.document_vector_retrieval import TopKRetriever
+from src.document_vector_retrieval import TopKRetriever, SessionStore
 from src.initialize_llm import MedicalLLM
+from src.initialize_embeddings import EmbeddingRegistry
+from src.knowledge_base import LabResultIndex
 from src.logging import Logger
+from src.profiling import ProfilingHooks
 import os
+import threading
 import time
+import uuid
 
 
 
@@ -15,6 +20,14 @@ st.set_page_config(
 )
 # Initialize logger
 logger = Logger()
+# Opt-in profiling: PROFILE_REQUESTS, or an X-Profile header if the operator allows it (see README)
+profiling = ProfilingHooks()
+
+# Conversation state of every browser session, bounded by SESSION_MAX (LRU); defined
+# before the sidebar, which clears remembered searches when the stores are refreshed
+@st.cache_resource
+def load_sessions():
+    return SessionStore()
 
 
 # Sidebar for file upload
@@ -35,8 +48,8 @@ with st.sidebar:
     # File uploader
     uploaded_file = st.file_uploader(
         "Upload Document",
-        type=["png", "jpg", "jpeg", "pdf", "xlsx", "csv", "txt"],
-        help="Supported formats: PNG, JPG, PDF, XLSX, CSV, TXT"
+        type=["png", "jpg", "jpeg", "tif", "tiff", "pdf", "xlsx", "csv", "txt"],
+        help="Supported formats: PNG, JPG, TIFF, PDF, XLSX, CSV, TXT"
     )
     
         # Handle file upload
@@ -54,9 +67,14 @@ with st.sidebar:
             
             # Add refresh button to update vector stores
             if st.button("🔄 Refresh Vector Databases"):
-                # Create retriever to update vector stores
-                retriever = TopKRetriever(k=3)
-                st.success("Vector Databases updated successfully!")
+                # Update vector stores; in shared serving mode only the indexer does that
+                if TopKRetriever.refresh_index():
+                    # Chunks remembered by conversations may have changed
+                    load_sessions().invalidate_retrievals()
+                    st.success("Vector Databases updated successfully!")
+                else:
+                    st.info("The shared index is refreshed by the indexer "
+                            "(python -m src.knowledge_base.shared_index); new files appear once it publishes.")
                 
         except Exception as e:
             st.error(f"Error uploading file: {str(e)}")
@@ -112,9 +130,18 @@ with st.sidebar:
 # Initialize the retriever and LLM (do this once when the app loads)
 @st.cache_resource
 def initialize_models():
+    # Load the embedding model once at startup instead of on the first query. It runs in
+    # the background so the page is served while torch loads; a query arriving before it
+    # finishes simply waits for the same load.
+    threading.Thread(target=EmbeddingRegistry.warm_up, name="embedding-warm-up", daemon=True).start()
     medical_llm = MedicalLLM(temperature=0.3)
     return medical_llm
 
+@st.cache_resource
+def load_lab_index():
+    # Reloads itself from disk whenever lab reports are re-ingested
+    return LabResultIndex()
+
 # Title and description
 st.title("🏥 Medical Document Assistant")
 st.markdown("""
@@ -124,6 +151,18 @@ It searches through lab reports and prescriptions to answer your questions.
 
 # Initialize LLM (only once)
 medical_llm = initialize_models()
+lab_index = load_lab_index()
+sessions = load_sessions()
+
+# One conversation per browser session; follow-ups reuse its retrieved chunks and history
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+session = sessions.get(st.session_state["session_id"])
+if session.turns or session.summary:
+    if st.button("🆕 New conversation"):
+        sessions.drop(st.session_state["session_id"])
+        st.session_state["session_id"] = uuid.uuid4().hex
+        session = sessions.get(st.session_state["session_id"])
 
 # Query input
 query = st.text_area("Enter your medical query:", 
@@ -151,37 +190,51 @@ with col2:
 if st.button("Get Answer"):
     if query:
         try:
+            # Profile this request if asked to (X-Profile header or PROFILE_REQUESTS)
+            with profiling.profile("query", profiling.request_enabled(st.context.headers)):
+                # Exact analyte lookups ("what was my latest HbA1c") are answered straight from
+                # the structured lab result index, without vector search or the LLM
+                result = None
+                if search_option != "Prescriptions Only":
+                    result = lab_index.answer(query, number_source=session.number_source)
+                    collection_searched = "lab results index"
+                    if result is not None:
+                        session.add_turn(query, result["response"])
+
+                if result is None:
+                    # Create columns for showing progress
+                    progress_col1, progress_col2 = st.columns(2)
             
-            # Create columns for showing progress
-            progress_col1, progress_col2 = st.columns(2)
-            
-            with progress_col1:
-                # Show retrieval progress
-                with st.spinner("🔍 Retrieving relevant documents..."):
-                    # Create retriever with dynamic k value
-                    retriever = TopKRetriever(k=k_docs)
-                    
-                    # Choose search method based on user selection
-                    if search_option == "Lab Reports Only":
-                        relevant_docs = retriever.search_lab_reports(query)
-                        collection_searched = "lab reports"
+                    with progress_col1:
+                        # Show retrieval progress
+                        with st.spinner("🔍 Retrieving relevant documents..."):
+                            # Choose collection based on user selection
+                            if search_option == "Lab Reports Only":
+                                collection = TopKRetriever.LAB_REPORTS_STORE
+                                collection_searched = "lab reports"
                    
-                    elif search_option == "Prescriptions Only":
-                        relevant_docs = retriever.search_prescriptions(query)
-                        collection_searched = "prescriptions"
+                            elif search_option == "Prescriptions Only":
+                                collection = TopKRetriever.PRESCRIPTIONS_STORE
+                                collection_searched = "prescriptions"
                    
-                    else:  # All Documents
-                        relevant_docs = retriever.search_all_documents(query)
-                        collection_searched = "all documents"
-                    
-                    st.success(f"Found {len(relevant_docs)} relevant documents in {collection_searched}")
+                            else:  # All Documents
+                                collection = TopKRetriever.COMBINED_STORE
+                                collection_searched = "all documents"
+
+                            # Follow-ups close to an earlier question reuse its chunks; otherwise a
+                            # retriever with dynamic k value searches the stores
+                            relevant_docs, reused = session.retrieve(query, collection, k_docs, TopKRetriever)
+                            reuse_note = " (reused from this conversation)" if reused else ""
+                            st.success(f"Found {len(relevant_docs)} relevant documents in {collection_searched}{reuse_note}")
+                            relevant_docs = session.context_for(relevant_docs)
             
-            with progress_col2:
-                # Show LLM processing progress
-                with st.spinner("🤔 Analyzing documents and generating response..."):
-                    result = medical_llm.get_response(query=query, context_docs=relevant_docs)
+                    with progress_col2:
+                        # Show LLM processing progress
+                        with st.spinner("🤔 Analyzing documents and generating response..."):
+                            result = medical_llm.get_response(query=query, context_docs=relevant_docs, session=session)
             
 
+
             # Display results in expandable sections
             st.markdown("### 📝 Medical Response")
             st.write(result["response"])
@@ -195,6 +248,9 @@ if st.button("Get Answer"):
                 for doc_num, source in result["source_details"].items():
                     st.markdown(f"**{doc_num}**: `{source}`")
                 st.info(f"Total Sources Used: {result['total_sources']}")
+
+            # Summarize older turns after the answer is shown, so it does not delay it
+            medical_llm.compact_history(session)
                 
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
@@ -211,5 +267,7 @@ st.markdown("""
   - **Prescriptions Only**: For questions about medications
   - **All Documents**: When you want to search everything
 - Upload new documents using the sidebar
+- Ask follow-up questions directly; the conversation remembers earlier questions and documents
+- Start a new conversation when switching to an unrelated topic
 - Remember to refresh the document index after uploading new files
 """)
\ No newline at end of file
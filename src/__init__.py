@@ -1,5 +1,35 @@
-from .logging import *
-from .knowledge_base import *
-from .document_vector_retrieval import *
-from .initialize_llm import *
+import importlib
 
+# Public classes are imported on first access so that e.g. Logger does not pull in
+# torch, chroma and tesseract. Maps attribute name -> submodule that defines it.
+_LAZY_ATTRS = {
+    "Logger": ".logging",
+    "EmbeddingRegistry": ".initialize_embeddings",
+    "SharedEmbeddings": ".initialize_embeddings",
+    "Ingestion": ".knowledge_base",
+    "CreateChunks": ".knowledge_base",
+    "VectorStore": ".knowledge_base",
+    "LabResultIndex": ".knowledge_base",
+    "IndexSnapshot": ".knowledge_base",
+    "SharedIndexReader": ".knowledge_base",
+    "TopKRetriever": ".document_vector_retrieval",
+    "SessionStore": ".document_vector_retrieval",
+    "MedicalLLM": ".initialize_llm",
+    "ImportProfiler": ".profiling",
+    "ProfilingHooks": ".profiling",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,3 +1,4 @@
 from .topk_docs import TopKRetriever
+from .sessions import ConversationSession, SessionStore
 
-__all__ = ["TopKRetriever"]
\ No newline at end of file
+__all__ = ["TopKRetriever", "ConversationSession", "SessionStore"]
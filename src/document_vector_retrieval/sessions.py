@@ -0,0 +1,323 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from src.logging import Logger
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+class ConversationSession:
+    """
+    State of one multi-turn consultation.
+
+    - Working set: every chunk retrieved in the session, keyed by its dedup_group
+      (or text), least recently used first and capped at max_chunks. Each chunk
+      keeps the same document number for the whole session, so [Doc X] citations
+      in earlier answers stay valid.
+    - Retrievals: the unit-normalized query embedding, collection, k and chunk
+      keys of the last few searches. A follow-up whose embedding is close enough
+      to one of them reuses its chunks instead of searching the stores again.
+      Reuse is per search, not per chunk: any other follow-up runs a full top-k
+      search. Ranking held chunks against a new query would need their
+      embeddings, which the stores' search results do not include, and every
+      chunk the LLM should cite has to be sent again anyway because each LLM
+      call is stateless.
+    - History: the last recent_turns turns verbatim; older turns are folded into
+      a running summary once the history exceeds history_chars.
+    """
+
+    def __init__(self, session_id: str, max_chunks: int = 40, max_retrievals: int = 8,
+                 reuse_threshold: float = 0.9, carry_chunks: int = 2,
+                 history_chars: int = 3000, recent_turns: int = 2):
+        """
+        Args:
+            session_id: Identifier of the session (e.g. one per browser tab)
+            max_chunks: Maximum number of chunks kept in the working set (default: 40)
+            max_retrievals: Number of past searches kept for reuse (default: 8)
+            reuse_threshold: Minimum cosine similarity between a follow-up and a past
+                query for the past results to be reused (default: 0.9)
+            carry_chunks: Number of chunks from the previous turn's context kept in the
+                next context when a search returns new chunks (default: 2)
+            history_chars: Size of the history above which older turns are summarized (default: 3000)
+            recent_turns: Number of most recent turns always kept verbatim (default: 2)
+        """
+        self.session_id = session_id
+        self.max_chunks = max_chunks
+        self.reuse_threshold = reuse_threshold
+        self.carry_chunks = carry_chunks
+        self.history_chars = history_chars
+        self.recent_turns = recent_turns
+        self.chunks: "OrderedDict[str, Document]" = OrderedDict()
+        self.numbers: Dict[str, int] = {}
+        # Source files cited directly (lab result index answers), numbered from the same counter
+        self.source_numbers: Dict[str, int] = {}
+        self.retrievals: deque = deque(maxlen=max_retrievals)
+        self.turns: List[Tuple[str, str]] = []
+        self.summary = ""
+        self.last_context: List[str] = []
+        self.updated_at = time.time()
+        self.lock = threading.RLock()
+        self._next_number = 1
+
+    @staticmethod
+    def chunk_key(document: Document) -> str:
+        """Key of a chunk in the working set; near-duplicates share their dedup_group"""
+        group = document.metadata.get("dedup_group")
+        if group:
+            return group
+        return hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()
+
+    def _remember(self, document: Document) -> Tuple[str, bool]:
+        """Add a chunk to (or refresh it in) the working set; returns its key and whether it is new"""
+        key = self.chunk_key(document)
+        is_new = key not in self.chunks
+        if is_new:
+            self.chunks[key] = document
+            self.numbers[key] = self._next_number
+            self._next_number += 1
+        else:
+            self.chunks.move_to_end(key)
+        return key, is_new
+
+    def _evict(self):
+        """Drop the least recently used chunks beyond max_chunks, and the searches that returned them"""
+        evicted = set()
+        while len(self.chunks) > self.max_chunks:
+            key, _ = self.chunks.popitem(last=False)
+            self.numbers.pop(key, None)
+            evicted.add(key)
+        if evicted:
+            kept = [entry for entry in self.retrievals if not evicted.intersection(entry[3])]
+            self.retrievals.clear()
+            self.retrievals.extend(kept)
+            self.last_context = [key for key in self.last_context if key not in evicted]
+
+    def cached_retrieval(self, collection: str, k: int, query_vector: np.ndarray) -> Optional[List[Document]]:
+        """Chunks of the most similar past search of collection with at least k results, if similar enough"""
+        with self.lock:
+            best, best_similarity = None, self.reuse_threshold
+            for entry_collection, entry_k, entry_vector, keys in self.retrievals:
+                if entry_collection != collection or entry_k < k:
+                    continue
+                similarity = float(entry_vector @ query_vector)
+                if similarity >= best_similarity:
+                    best, best_similarity = keys, similarity
+            if best is None:
+                return None
+            documents = []
+            for key in best[:k]:
+                self.chunks.move_to_end(key)
+                documents.append(self.chunks[key])
+            return documents
+
+    def record_retrieval(self, collection: str, k: int, query_vector: np.ndarray,
+                         documents: List[Document]) -> int:
+        """
+        Add a search's chunks to the working set
+
+        Returns:
+            Number of chunks that were not in the working set yet
+        """
+        with self.lock:
+            keys, new = [], 0
+            for document in documents:
+                key, is_new = self._remember(document)
+                keys.append(key)
+                new += is_new
+            self.retrievals.append((collection, k, query_vector, keys))
+            self._evict()
+            return new
+
+    def retrieve(self, query: str, collection: str, k: int,
+                 retriever_factory: Callable[[int], object], embeddings=None) -> Tuple[List[Document], bool]:
+        """
+        Retrieve the chunks for a turn, searching only when the session cannot answer from its working set
+
+        Args:
+            query: The user's query
+            collection: "lab_reports", "prescriptions" or "combined"
+            k: Number of chunks to retrieve
+            retriever_factory: Called with k to create a TopKRetriever when a search is needed
+            embeddings: Embedding model for the query (default: EmbeddingRegistry.get())
+
+        Returns:
+            (chunks, whether they were reused from the session)
+        """
+        if embeddings is None:
+            from src.initialize_embeddings import EmbeddingRegistry
+            embeddings = EmbeddingRegistry.get()
+        # Embedded once: used both to match past searches and to search the stores
+        query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        unit_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+
+        documents = self.cached_retrieval(collection, k, unit_vector)
+        if documents is not None:
+            return documents, True
+
+        retriever = retriever_factory(k)
+        documents = retriever.get_relevant_documents(query, collection, query_vector=query_vector.tolist())
+        new = self.record_retrieval(collection, k, unit_vector, documents)
+        Logger().log_system("info",
+            f"Session {self.session_id}: searched {collection}, {new} of {len(documents)} chunks new to the session")
+        return documents, False
+
+    def context_for(self, documents: List[Document]) -> List[Document]:
+        """
+        Context of a turn: its chunks, plus the top carry_chunks chunks of the previous turn's
+        context, so a short follow-up ("is that normal?") still sees what it refers to
+        """
+        with self.lock:
+            context = list(documents)
+            keys = {self.chunk_key(document) for document in documents}
+            for key in self.last_context[:self.carry_chunks]:
+                if key not in keys and key in self.chunks:
+                    context.append(self.chunks[key])
+                    keys.add(key)
+            for document in context:
+                self._remember(document)
+            self.last_context = [self.chunk_key(document) for document in context]
+            self._evict()
+            return context
+
+    def number(self, document: Document) -> int:
+        """Document number of a chunk, stable for the whole session"""
+        with self.lock:
+            key, _ = self._remember(document)
+            return self.numbers[key]
+
+    def number_source(self, source: str) -> int:
+        """Document number of a whole source file, stable for the whole session"""
+        with self.lock:
+            number = self.source_numbers.get(source)
+            if number is None:
+                number = self.source_numbers[source] = self._next_number
+                self._next_number += 1
+            return number
+
+    def add_turn(self, query: str, response: str):
+        with self.lock:
+            self.turns.append((query, response))
+            self.updated_at = time.time()
+
+    def history_text(self) -> str:
+        """Summary of older turns followed by the recent turns, as sent to the LLM"""
+        with self.lock:
+            parts = [f"Summary of earlier conversation: {self.summary}"] if self.summary else []
+            for query, response in self.turns:
+                parts.append(f"User: {query}\nAssistant: {response}")
+            return "\n\n".join(parts)
+
+    def needs_compaction(self) -> bool:
+        return len(self.turns) > self.recent_turns and len(self.history_text()) > self.history_chars
+
+    def compact(self, summarize: Optional[Callable[[str, List[Tuple[str, str]]], str]] = None):
+        """
+        Fold all but the recent turns into the summary
+
+        Args:
+            summarize: Called with the current summary and the turns to fold, returns the new
+                summary (e.g. MedicalLLM.summarize_history). Without it, or if it fails, the
+                first sentence of each answer is kept.
+        """
+        with self.lock:
+            if len(self.turns) <= self.recent_turns:
+                return
+            folded = self.turns[:len(self.turns) - self.recent_turns]
+            summary = None
+            if summarize is not None:
+                try:
+                    summary = summarize(self.summary, folded)
+                except Exception as e:
+                    Logger().log_system("warning", f"Could not summarize session {self.session_id}: {e}")
+            if not summary:
+                lines = [self.summary] if self.summary else []
+                for query, response in folded:
+                    first_sentence = _SENTENCE_END.split(response.strip(), 1)[0][:200]
+                    lines.append(f"Asked: {query[:200]} Answered: {first_sentence}")
+                summary = " ".join(lines)
+            # Never let the summary itself outgrow the budget
+            self.summary = summary[-(self.history_chars // 2):]
+            self.turns = self.turns[len(folded):]
+
+
+class SessionStore:
+    """
+    Process-wide, bounded map of session id -> ConversationSession.
+
+    At most max_sessions sessions are kept; the least recently used one is
+    evicted when a new session would exceed that, so memory stays bounded at
+    roughly max_sessions x (max_chunks chunks + a few query embeddings + the
+    history budget). An evicted session simply starts over with a fresh search.
+
+    Limits come from the environment: SESSION_MAX (default 200),
+    SESSION_MAX_CHUNKS (40), SESSION_REUSE_THRESHOLD (0.9),
+    SESSION_CARRY_CHUNKS (2), SESSION_HISTORY_CHARS (3000) and
+    SESSION_RECENT_TURNS (2).
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None):
+        """
+        Args:
+            max_sessions: Maximum number of sessions kept (default: SESSION_MAX or 200)
+        """
+        self.logger = Logger()
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MAX", "200"))
+        self.session_settings = {
+            "max_chunks": int(os.getenv("SESSION_MAX_CHUNKS", "40")),
+            "reuse_threshold": float(os.getenv("SESSION_REUSE_THRESHOLD", "0.9")),
+            "carry_chunks": int(os.getenv("SESSION_CARRY_CHUNKS", "2")),
+            "history_chars": int(os.getenv("SESSION_HISTORY_CHARS", "3000")),
+            "recent_turns": int(os.getenv("SESSION_RECENT_TURNS", "2")),
+        }
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> ConversationSession:
+        """Get a session, creating it (and evicting the least recently used one) if needed"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+            session = ConversationSession(session_id, **self.session_settings)
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, _ = self._sessions.popitem(last=False)
+                self.logger.log_system("info", f"Evicted conversation session {evicted_id}")
+            return session
+
+    def drop(self, session_id: str):
+        """Forget a session (e.g. when the user starts a new conversation)"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def invalidate_retrievals(self):
+        """Forget every session's past searches, e.g. after the stores were refreshed"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            with session.lock:
+                session.retrievals.clear()
+
+
+if __name__ == "__main__":
+    # Example: a query and a follow-up in the same session
+    from src.document_vector_retrieval import TopKRetriever
+
+    sessions = SessionStore()
+    session = sessions.get("example")
+    for query in ["What were my blood test results?", "What were the results of my blood tests?"]:
+        documents, reused = session.retrieve(query, TopKRetriever.COMBINED_STORE, 3, TopKRetriever)
+        print(f"{query} -> {len(documents)} chunks ({'reused' if reused else 'searched'})")
+        for document in session.context_for(documents):
+            print(f"  [Doc {session.number(document)}] {document.metadata.get('source', 'Unknown')}")
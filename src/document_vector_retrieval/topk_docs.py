@@ -1,6 +1,6 @@
-from typing import List
+import os
+from typing import List, Optional
 from langchain_core.documents import Document
-from src.knowledge_base import VectorStore
 from src.logging import Logger
 
 class TopKRetriever:
@@ -11,16 +11,34 @@ class TopKRetriever:
     LAB_REPORTS_STORE = "lab_reports"
     PRESCRIPTIONS_STORE = "prescriptions"
     
-    def __init__(self, k: int = 5):
+    def __init__(self, k: int = 5, num_shards: Optional[int] = None, serving: Optional[bool] = None):
         """
         Initialize the retriever and create/update vector stores
         
         Args:
             k: Number of documents to retrieve (default: 5)
+            num_shards: Number of index shards; searches fan out to all shards in parallel and
+                the per-shard top-k are merged (default: VECTOR_SHARDS or 1, unsharded)
+            serving: Search the shared, memory-mapped index published for serving workers
+                instead of opening the stores (default: INDEX_SERVING=shared)
         """
         self.logger = Logger()
-        self.vector_store = VectorStore()
         self.k = k
+        self.serving = os.getenv("INDEX_SERVING", "") == "shared" if serving is None else serving
+        # Near-duplicate chunks are collapsed, so fetch extra candidates to still return k
+        self.dedup = os.getenv("DEDUP_ENABLED", "1") == "1"
+        self.fetch_k = k * int(os.getenv("DEDUP_OVERFETCH", "3")) if self.dedup else k
+
+        if self.serving:
+            # Serving workers never open Chroma or build stores; the indexer publishes generations
+            from src.knowledge_base import SharedIndexReader
+            self.shared_index = SharedIndexReader.shared()
+            return
+
+        # Imported here so importing the retriever does not load chroma/torch
+        from src.knowledge_base import VectorStore
+
+        self.vector_store = VectorStore(num_shards=num_shards)
         
         # Create/update all stores on initialization
         self.logger.log_system("info", "Creating/updating vector stores...")
@@ -28,13 +46,15 @@ class TopKRetriever:
         if not self.stores:
             self.logger.log_system("warning", "No vector stores were created. Check if there are documents in the docs directory.")
         
-    def get_relevant_documents(self, query: str, collection: str = COMBINED_STORE) -> List[Document]:
+    def get_relevant_documents(self, query: str, collection: str = COMBINED_STORE,
+                               query_vector: Optional[List[float]] = None) -> List[Document]:
         """
         Get the top-k most relevant documents for a query from a specific collection
         
         Args:
             query: Search query
             collection: Which collection to search ("lab_reports", "prescriptions", or "combined")
+            query_vector: Embedding of the query, if the caller already computed it
             
         Returns:
             List of relevant documents
@@ -43,6 +63,16 @@ class TopKRetriever:
             raise ValueError(f"Invalid collection: {collection}. Must be one of: combined, lab_reports, prescriptions")
             
         try:
+            if self.serving:
+                if query_vector is not None:
+                    results = self.shared_index.similarity_search_by_vector(collection, query_vector, k=self.fetch_k)
+                else:
+                    results = self.shared_index.similarity_search(collection, query, k=self.fetch_k)
+                results = self._collapse(results)
+                self.logger.log_system("info",
+                    f"Found {len(results)} relevant documents in {collection} (generation {self.shared_index.generation})")
+                return results
+
             # Ensure store exists and is populated
             if collection == self.COMBINED_STORE:
                 store = self.vector_store.create_combined_store()
@@ -55,13 +85,39 @@ class TopKRetriever:
                 self.logger.log_system("warning", f"No documents found in {collection} store")
                 return []
                 
-            results = store.similarity_search(query, k=self.k)
+            if query_vector is not None:
+                results = self._collapse(store.similarity_search_by_vector(query_vector, k=self.fetch_k))
+            else:
+                results = self._collapse(store.similarity_search(query, k=self.fetch_k))
             self.logger.log_system("info", f"Found {len(results)} relevant documents in {collection} store")
             return results
         except Exception as e:
             self.logger.log_system("error", f"Error retrieving documents from {collection} store: {str(e)}")
             raise
             
+    def _collapse(self, results: List[Document]) -> List[Document]:
+        """Keep one chunk per near-duplicate group, up to k"""
+        if not self.dedup:
+            return results[:self.k]
+        from src.knowledge_base.dedup import collapse_duplicates
+        return collapse_duplicates(results, self.k)
+
+    @staticmethod
+    def refresh_index(num_shards: Optional[int] = None) -> bool:
+        """
+        Create/update all vector stores
+
+        Returns:
+            False in shared serving mode (INDEX_SERVING=shared), where workers never open
+            Chroma: the indexer refreshes and publishes with python -m src.knowledge_base.shared_index
+        """
+        if os.getenv("INDEX_SERVING", "") == "shared":
+            return False
+        from src.knowledge_base import VectorStore
+
+        VectorStore(num_shards=num_shards).create_all_stores()
+        return True
+
     def search_lab_reports(self, query: str) -> List[Document]:
         """
         Search specifically in lab reports collection
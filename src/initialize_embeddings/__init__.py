@@ -0,0 +1,3 @@
+from .load_embeddings import EmbeddingRegistry, SharedEmbeddings
+
+__all__ = ["EmbeddingRegistry", "SharedEmbeddings"]
\ No newline at end of file
@@ -0,0 +1,168 @@
+# this file coalesces embed calls from many threads into large model batches
+
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from src.logging import Logger
+
+
+class _EmbedRequest:
+    """A single embed call waiting for all of its texts to be embedded"""
+
+    __slots__ = ("texts", "vectors", "remaining", "future", "lock")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.vectors: List[Optional[List[float]]] = [None] * len(texts)
+        self.remaining = len(texts)
+        self.future: Future = Future()
+        self.lock = threading.Lock()
+
+    def set_vector(self, index: int, vector: List[float]):
+        with self.lock:
+            self.vectors[index] = vector
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.future.set_result(self.vectors)
+
+    def set_exception(self, error: Exception):
+        with self.lock:
+            if self.future.done():
+                return
+            self.remaining = 0
+        self.future.set_exception(error)
+
+
+class EmbeddingBatcher:
+    """
+    In-process embedding service with dynamic batching.
+
+    Callers from any thread or coroutine submit texts; a single worker thread
+    collects pending texts into one batch until either max_batch_size texts are
+    queued or max_wait_ms has passed since the first one arrived, then runs the
+    model once for the whole batch. Interactive queries are always taken from the
+    queue before background indexing texts, so a query never waits behind a
+    large add_documents call.
+    """
+
+    QUERY_PRIORITY = 0
+    INDEXING_PRIORITY = 1
+
+    def __init__(self, model: Embeddings, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        """
+        Args:
+            model: Embedding model that does the actual work
+            max_batch_size: Maximum number of texts per model call (default: 64)
+            max_wait_ms: Maximum time to wait for a batch to fill up (default: 5ms)
+        """
+        self.logger = Logger()
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        # Items are (priority, sequence, request, index); the sequence keeps FIFO order per priority
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+        self.logger.log_system("info",
+            f"Started embedding batcher (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})")
+
+    def submit(self, texts: List[str], priority: int = INDEXING_PRIORITY) -> Future:
+        """
+        Queue texts for embedding
+
+        Args:
+            texts: Texts to embed
+            priority: QUERY_PRIORITY or INDEXING_PRIORITY (lower runs first)
+
+        Returns:
+            Future resolving to the list of vectors, in the same order as texts
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("Embedding batcher has been shut down")
+
+        request = _EmbedRequest(list(texts))
+        if not request.texts:
+            request.future.set_result([])
+            return request.future
+
+        for index in range(len(request.texts)):
+            self._queue.put((priority, next(self._sequence), request, index))
+        return request.future
+
+    def embed(self, texts: List[str], priority: int = INDEXING_PRIORITY) -> List[List[float]]:
+        """Embed texts, blocking until the batch containing them has run"""
+        return self.submit(texts, priority).result()
+
+    async def aembed(self, texts: List[str], priority: int = INDEXING_PRIORITY) -> List[List[float]]:
+        """Embed texts without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(texts, priority))
+
+    def _collect_batch(self) -> list:
+        """Block for the first item, then keep collecting until the batch is full or the wait is over"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                # Still drain whatever is already queued, but don't wait for more
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Worker loop: collect a batch, run the model once, hand results back"""
+        while not self._stopped.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            # Skip texts whose request already failed in an earlier batch
+            batch = [item for item in batch if not item[2].future.done()]
+            if not batch:
+                continue
+
+            texts = [request.texts[index] for _, _, request, index in batch]
+            try:
+                vectors = self.model.embed_documents(texts)
+            except Exception as e:
+                self.logger.log_system("error", f"Embedding batch of {len(texts)} texts failed: {str(e)}")
+                for _, _, request, _ in batch:
+                    request.set_exception(e)
+                continue
+
+            for (_, _, request, index), vector in zip(batch, vectors):
+                request.set_vector(index, vector)
+
+    def shutdown(self):
+        """Stop the worker thread and fail any texts still waiting in the queue"""
+        self._stopped.set()
+        self._worker.join(timeout=5)
+        while True:
+            try:
+                _, _, request, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            request.set_exception(RuntimeError("Embedding batcher has been shut down"))
+        self.logger.log_system("info", "Stopped embedding batcher")
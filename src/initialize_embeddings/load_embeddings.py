@@ -0,0 +1,192 @@
+# this file keeps one process-wide copy of the sentence-transformers embedding model
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from src.logging import Logger
+from .embedding_server import EmbeddingBatcher
+
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+
+# Quantized ONNX export shipped with the sentence-transformers model repos
+ONNX_INT8_FILE_NAME = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    Thread-safe embedding model shared by every caller in the process.
+
+    All calls go through an EmbeddingBatcher, so only its worker thread ever
+    touches the model (the fast tokenizers used by sentence-transformers are not
+    safe to share between threads) and concurrent callers are batched together.
+    Queries are embedded ahead of documents being indexed.
+    """
+
+    def __init__(self, model: Embeddings, model_name: str,
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        """
+        Args:
+            model: Loaded HuggingFace embedding model
+            model_name: Name of the model, used for logging
+            max_batch_size: Maximum number of texts per model call (default: 64)
+            max_wait_ms: Maximum time to wait for a batch to fill up (default: 5ms)
+        """
+        self.model = model
+        self.model_name = model_name
+        self.batcher = EmbeddingBatcher(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of document texts at indexing priority"""
+        return self.batcher.embed(texts, EmbeddingBatcher.INDEXING_PRIORITY)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query text at interactive priority"""
+        return self.batcher.embed([text], EmbeddingBatcher.QUERY_PRIORITY)[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.batcher.aembed(texts, EmbeddingBatcher.INDEXING_PRIORITY)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.batcher.aembed([text], EmbeddingBatcher.QUERY_PRIORITY))[0]
+
+
+class EmbeddingRegistry:
+    """
+    Process-wide registry of embedding models.
+
+    Each (model, device, threads, backend) combination is loaded from disk exactly
+    once and shared by every VectorStore in the process. Settings default to the
+    following environment variables:
+        - EMBEDDING_DEVICE: "cpu", "cuda", "mps" (default: let sentence-transformers pick)
+        - EMBEDDING_THREADS: number of torch intra-op threads (default: torch default)
+        - EMBEDDING_BACKEND: "torch", "onnx" or "onnx-int8" (default: "torch")
+        - EMBEDDING_MAX_BATCH_SIZE: maximum texts per batched model call (default: 64)
+        - EMBEDDING_MAX_WAIT_MS: maximum time to wait for a batch to fill up (default: 5)
+    """
+
+    _models: Dict[Tuple, SharedEmbeddings] = {}
+    _lock = threading.Lock()
+    _logger: Optional[Logger] = None
+
+    @classmethod
+    def _get_logger(cls) -> Logger:
+        if cls._logger is None:
+            cls._logger = Logger()
+        return cls._logger
+
+    @staticmethod
+    def _resolve_settings(device: Optional[str], num_threads: Optional[int],
+                          backend: Optional[str]) -> Tuple[Optional[str], Optional[int], str]:
+        """Fill in unset settings from the environment"""
+        device = device or os.getenv("EMBEDDING_DEVICE") or None
+        if num_threads is None and os.getenv("EMBEDDING_THREADS"):
+            num_threads = int(os.getenv("EMBEDDING_THREADS"))
+        backend = (backend or os.getenv("EMBEDDING_BACKEND") or "torch").lower()
+        if backend not in ("torch", "onnx", "onnx-int8"):
+            raise ValueError(f"Invalid embedding backend: {backend}. Must be one of: torch, onnx, onnx-int8")
+        return device, num_threads, backend
+
+    @classmethod
+    def _load(cls, model_name: str, device: Optional[str], num_threads: Optional[int],
+              backend: str) -> SharedEmbeddings:
+        """Load a model from disk with the given settings"""
+        # Imported here so that importing the registry does not load torch
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        logger = cls._get_logger()
+        start = time.perf_counter()
+
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+
+        model_kwargs = {}
+        if device:
+            model_kwargs["device"] = device
+        if backend != "torch":
+            # ONNX runtime inference is only used on CPU
+            model_kwargs["backend"] = "onnx"
+            if backend == "onnx-int8":
+                model_kwargs["model_kwargs"] = {"file_name": ONNX_INT8_FILE_NAME}
+
+        max_batch_size = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+        max_wait_ms = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+
+        # Let sentence-transformers run each coalesced batch as a single forward pass
+        model = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs=model_kwargs,
+            encode_kwargs={"batch_size": max_batch_size}
+        )
+
+        logger.log_system("info",
+            f"Loaded embedding model {model_name} (device={device or 'auto'}, "
+            f"threads={num_threads or 'default'}, backend={backend}) "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return SharedEmbeddings(model, model_name, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    @classmethod
+    def get(cls, model_name: str = DEFAULT_MODEL_NAME, device: Optional[str] = None,
+            num_threads: Optional[int] = None, backend: Optional[str] = None) -> SharedEmbeddings:
+        """
+        Get the shared embedding model, loading it on first use
+
+        Args:
+            model_name: HuggingFace model name (default: all-mpnet-base-v2)
+            device: Device to run the model on (default: EMBEDDING_DEVICE or auto)
+            num_threads: Torch intra-op threads (default: EMBEDDING_THREADS or torch default)
+            backend: "torch", "onnx" or "onnx-int8" (default: EMBEDDING_BACKEND or "torch")
+
+        Returns:
+            Thread-safe embedding model shared across the process
+        """
+        device, num_threads, backend = cls._resolve_settings(device, num_threads, backend)
+        key = (model_name, device, num_threads, backend)
+
+        model = cls._models.get(key)
+        if model is not None:
+            return model
+
+        with cls._lock:
+            # Another thread may have loaded it while we waited for the lock
+            model = cls._models.get(key)
+            if model is None:
+                model = cls._load(model_name, device, num_threads, backend)
+                cls._models[key] = model
+        return model
+
+    @classmethod
+    def warm_up(cls, model_name: str = DEFAULT_MODEL_NAME, device: Optional[str] = None,
+                num_threads: Optional[int] = None, backend: Optional[str] = None) -> SharedEmbeddings:
+        """
+        Load the model and run one dummy query so the first real request does not
+        pay for weight loading or lazy kernel initialization
+
+        Returns:
+            The warmed-up shared embedding model
+        """
+        model = cls.get(model_name, device, num_threads, backend)
+        start = time.perf_counter()
+        model.embed_query("warm up")
+        cls._get_logger().log_system("info",
+            f"Warmed up embedding model {model_name} in {time.perf_counter() - start:.2f}s")
+        return model
+
+    @classmethod
+    def clear(cls):
+        """Stop all batchers and drop all loaded models (mainly useful to free memory)"""
+        with cls._lock:
+            for model in cls._models.values():
+                model.batcher.shutdown()
+            cls._models.clear()
+
+
+if __name__ == "__main__":
+    embeddings = EmbeddingRegistry.warm_up()
+    print(len(embeddings.embed_query("What were my blood test results?")))
+    # Second lookup returns the same loaded instance
+    print(EmbeddingRegistry.get() is embeddings)
@@ -3,9 +3,9 @@
 from dotenv import load_dotenv
 import os
 from typing import List, Dict, Tuple
-from langchain_cerebras import ChatCerebras
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.documents import Document
+from src.logging import Logger
 
 
 load_dotenv()
@@ -20,6 +20,9 @@ class MedicalLLM:
         Args:
             temperature: Sampling temperature for the model (default: 0.5)
         """
+        from langchain_cerebras import ChatCerebras
+
+        self.logger = Logger()
         self.llm = ChatCerebras(
             model="llama-4-scout-17b-16e-instruct",
             temperature=temperature,
@@ -37,13 +40,15 @@ class MedicalLLM:
                                 If the required information is not in the provided context, state that clearly rather than making assumptions.
                                 DO NOT provide medical advice beyond what's explicitly stated in the source documents."""
 
-    def get_response(self, query: str, context_docs: List[Document]) -> Dict[str, any]:
+    def get_response(self, query: str, context_docs: List[Document], session=None) -> Dict[str, any]:
         """
         Get LLM response based on query and retrieved documents
         
         Args:
             query: User's medical query
             context_docs: List of relevant documents retrieved by TopKRetriever
+            session: ConversationSession of a multi-turn consultation; its history is included,
+                documents keep their session-wide numbers and the turn is recorded (default: None)
             
         Returns:
             Dictionary containing:
@@ -56,9 +61,15 @@ class MedicalLLM:
         source_details = {}
 
         for i, doc in enumerate(context_docs, 1):
+            number = session.number(doc) if session is not None else i
             source_path = doc.metadata.get('source', 'Unknown')
-            source_details[f"Document {i}"] = source_path
-            context += f"\nDocument {i} (Source: {source_path}):\n{doc.page_content}\n"
+            source_details[f"Document {number}"] = source_path
+            context += f"\nDocument {number} (Source: {source_path}):\n{doc.page_content}\n"
+
+        # Earlier turns, compacted by compact_history(), so follow-ups can refer back to them
+        history = session.history_text() if session is not None else ""
+        if history:
+            context = f"\n\nConversation so far:\n{history}\n{context}"
             
         # Create messages with system prompt, context, and query
         messages = [
@@ -70,7 +81,8 @@ class MedicalLLM:
             # Get LLM response
             response = self.llm.invoke(messages)
             
-
+            if session is not None:
+                session.add_turn(query, response.content)
             
             return {
                 "response": response.content,
@@ -80,6 +92,31 @@ class MedicalLLM:
         except Exception as e:
             self.logger.log_system("error", f"Error processing query: {str(e)}")
             raise
+
+    def summarize_history(self, summary: str, turns: List[Tuple[str, str]]) -> str:
+        """
+        Fold conversation turns into a short running summary
+        
+        Args:
+            summary: Summary of the turns before these ones (may be empty)
+            turns: (query, response) pairs to fold in, oldest first
+            
+        Returns:
+            The new summary
+        """
+        transcript = "\n\n".join(f"User: {query}\nAssistant: {response}" for query, response in turns)
+        messages = [
+            SystemMessage(content="Summarize this medical consultation in at most 5 short sentences. "
+                                  "Keep the questions asked, the key findings with their values and units, "
+                                  "and the [Doc X] citations. Do not add anything that is not stated."),
+            HumanMessage(content=f"Earlier summary: {summary or 'none'}\n\nNew turns:\n{transcript}")
+        ]
+        return self.llm.invoke(messages).content.strip()
+
+    def compact_history(self, session):
+        """Summarize a session's older turns once its history exceeds the session's budget"""
+        if session.needs_compaction():
+            session.compact(self.summarize_history)
     
 
     
@@ -1,5 +1,28 @@
-from .data_ingestion import Ingestion
-from .create_chunks import CreateChunks
-from .create_vector_store import VectorStore
+import importlib
 
-__all__ = ["Ingestion",  "CreateChunks", "VectorStore"]
\ No newline at end of file
+# Loaded on first access: VectorStore pulls in chroma and the embedding stack
+_LAZY_ATTRS = {
+    "Ingestion": ".data_ingestion",
+    "CreateChunks": ".create_chunks",
+    "VectorStore": ".create_vector_store",
+    "LabResultIndex": ".lab_results",
+    "IndexSnapshot": ".index_snapshot",
+    "IndexPublisher": ".shared_index",
+    "SharedIndexReader": ".shared_index",
+}
+
+__all__ = ["Ingestion",  "CreateChunks", "VectorStore", "LabResultIndex", "IndexSnapshot",
+           "IndexPublisher", "SharedIndexReader"]
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
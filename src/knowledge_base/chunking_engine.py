@@ -0,0 +1,305 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from src.logging import Logger
+
+
+# Same separators, in the same order, as LangChain's RecursiveCharacterTextSplitter
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+def split_offsets(text: str, chunk_size: int, chunk_overlap: int,
+                  separators: List[str] = DEFAULT_SEPARATORS) -> List[Tuple[int, int]]:
+    """
+    Recursively split text into (start, end) offsets without building substrings.
+
+    Follows RecursiveCharacterTextSplitter (keep_separator=True, strip_whitespace=True)
+    step for step, so text[start:end] is exactly the chunk LangChain would produce.
+
+    Args:
+        text: Text to split
+        chunk_size: Maximum chunk size in characters
+        chunk_overlap: Maximum overlap between consecutive chunks in characters
+        separators: Separators to try, in order
+
+    Returns:
+        List of (start, end) offsets into text
+    """
+    chunks: List[Tuple[int, int]] = []
+
+    def strip(start: int, end: int) -> Optional[Tuple[int, int]]:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if start < end else None
+
+    def merge(pieces: List[Tuple[int, int]]):
+        # Pieces are contiguous, so a chunk is just [first piece start, last piece end)
+        current: List[Tuple[int, int]] = []
+        total = 0
+        for start, end in pieces:
+            length = end - start
+            if total + length > chunk_size and current:
+                chunk = strip(current[0][0], current[-1][1])
+                if chunk:
+                    chunks.append(chunk)
+                while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                    total -= current[0][1] - current[0][0]
+                    current = current[1:]
+            current.append((start, end))
+            total += length
+        if current:
+            chunk = strip(current[0][0], current[-1][1])
+            if chunk:
+                chunks.append(chunk)
+
+    def split(start: int, end: int, remaining: List[str]):
+        separator, next_separators = remaining[-1], []
+        for i, candidate in enumerate(remaining):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, next_separators = candidate, remaining[i + 1:]
+                break
+
+        # Separators stay attached to the start of the piece that follows them
+        if separator:
+            pattern = re.compile(re.escape(separator))
+            bounds = [start] + [m.start() for m in pattern.finditer(text, start, end) if m.start() != start]
+            pieces = list(zip(bounds, bounds[1:] + [end]))
+        else:
+            pieces = [(i, i + 1) for i in range(start, end)]
+
+        good: List[Tuple[int, int]] = []
+        for piece_start, piece_end in pieces:
+            if piece_end - piece_start < chunk_size:
+                good.append((piece_start, piece_end))
+                continue
+            if good:
+                merge(good)
+                good = []
+            if not next_separators:
+                chunks.append((piece_start, piece_end))
+            else:
+                split(piece_start, piece_end, next_separators)
+        if good:
+            merge(good)
+
+    split(0, len(text), separators)
+    return chunks
+
+
+def _split_offsets_worker(args: Tuple[str, int, int]) -> array:
+    """Process pool entry point: return flat [start, end, start, end, ...] offsets"""
+    text, chunk_size, chunk_overlap = args
+    flat = array("q")
+    for start, end in split_offsets(text, chunk_size, chunk_overlap):
+        flat.append(start)
+        flat.append(end)
+    return flat
+
+
+class ChunkSet(Sequence):
+    """
+    Compact, array-backed collection of chunks.
+
+    Each chunk is only (document id, start, end) in three typed arrays, plus shared
+    references to the source texts and metadata of the documents it came from. A
+    chunk's text and Document are built on access, so the full set of chunk strings
+    and metadata copies never has to exist at once. Indexing and slicing return the
+    same Documents RecursiveCharacterTextSplitter(add_start_index=True) produces,
+    except that start_index is always the chunk's real offset (LangChain searches
+    for the chunk text and can land on an earlier copy in repetitive text).
+    """
+
+    __slots__ = ("texts", "metadatas", "doc_ids", "starts", "ends")
+
+    def __init__(self, texts: List[str], metadatas: List[dict]):
+        """
+        Args:
+            texts: Source document texts (shared, not copied)
+            metadatas: Source document metadata (shared, not copied)
+        """
+        self.texts = texts
+        self.metadatas = metadatas
+        self.doc_ids = array("i")
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def append(self, doc_id: int, start: int, end: int):
+        self.doc_ids.append(doc_id)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text(self, index: int) -> str:
+        """Materialize the text of one chunk"""
+        return self.texts[self.doc_ids[index]][self.starts[index]:self.ends[index]]
+
+    def metadata(self, index: int) -> dict:
+        """Build the metadata of one chunk (source metadata plus start_index)"""
+        return {**self.metadatas[self.doc_ids[index]], "start_index": self.starts[index]}
+
+    def source(self, index: int) -> Optional[str]:
+        return self.metadatas[self.doc_ids[index]].get("source")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        return Document(page_content=self.text(index), metadata=self.metadata(index))
+
+    def __iter__(self) -> Iterator[Document]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def sizes(self) -> List[int]:
+        """Chunk lengths in characters, computed from offsets"""
+        return [end - start for start, end in zip(self.starts, self.ends)]
+
+    def sources(self) -> Set[str]:
+        """Distinct source paths, read from document metadata only"""
+        used = set(self.doc_ids)
+        return {self.metadatas[doc_id]["source"] for doc_id in used if "source" in self.metadatas[doc_id]}
+
+    @classmethod
+    def concat(cls, chunk_sets: List["ChunkSet"]) -> "ChunkSet":
+        """Combine several chunk sets, still sharing their source texts"""
+        combined = cls([], [])
+        for chunk_set in chunk_sets:
+            offset = len(combined.texts)
+            combined.texts.extend(chunk_set.texts)
+            combined.metadatas.extend(chunk_set.metadatas)
+            combined.doc_ids.extend(doc_id + offset for doc_id in chunk_set.doc_ids)
+            combined.starts.extend(chunk_set.starts)
+            combined.ends.extend(chunk_set.ends)
+        return combined
+
+
+class ChunkingEngine:
+    """
+    Splits documents into chunks, in parallel across documents.
+
+    - chunk() returns a compact ChunkSet of offsets. Large batches are split on a
+      shared process pool (only texts go in and offsets come back); small ones are
+      split inline, where the pool would cost more than it saves.
+    - chunk_exact() runs LangChain's RecursiveCharacterTextSplitter exactly as
+      CreateChunks always did and returns a list of Documents, for when the output
+      must be byte-for-byte what it was before.
+
+    Throughput of the last run is logged and kept in last_stats.
+    """
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 max_workers: Optional[int] = None, parallel_threshold_chars: int = 2_000_000):
+        """
+        Args:
+            chunk_size: Size of each chunk in characters (default: 1000)
+            chunk_overlap: Overlap between chunks in characters (default: 200)
+            max_workers: Size of the shared process pool (default: number of CPUs)
+            parallel_threshold_chars: Minimum total text size before the process pool
+                is used (default: 2,000,000 characters)
+        """
+        self.logger = Logger()
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.parallel_threshold_chars = parallel_threshold_chars
+        self.last_stats: Dict[str, float] = {}
+
+    @classmethod
+    def _get_executor(cls, max_workers: int) -> ProcessPoolExecutor:
+        with cls._executor_lock:
+            if cls._executor is None:
+                # spawn, not fork: the app runs OCR/embedding threads that must not be forked
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return cls._executor
+
+    def _record_stats(self, mode: str, documents: int, chunks: int, chars: int, elapsed: float):
+        self.last_stats = {
+            "mode": mode,
+            "documents": documents,
+            "chunks": chunks,
+            "characters": chars,
+            "seconds": elapsed,
+            "chars_per_second": chars / elapsed if elapsed > 0 else 0.0,
+        }
+        self.logger.log_system("info",
+            f"Chunked {documents} documents ({chars / 1e6:.2f}M chars) into {chunks} chunks "
+            f"in {elapsed:.3f}s [{mode}, {self.last_stats['chars_per_second'] / 1e6:.2f}M chars/s]"
+        )
+
+    def chunk(self, documents: List[Document]) -> ChunkSet:
+        """
+        Split documents into a compact ChunkSet
+
+        Args:
+            documents: Documents to split
+
+        Returns:
+            ChunkSet referencing the documents' texts and metadata
+        """
+        start_time = time.perf_counter()
+        texts = [doc.page_content for doc in documents]
+        chunk_set = ChunkSet(texts, [doc.metadata for doc in documents])
+        total_chars = sum(len(text) for text in texts)
+
+        jobs = [(text, self.chunk_size, self.chunk_overlap) for text in texts]
+        parallel = len(texts) > 1 and self.max_workers > 1 and total_chars >= self.parallel_threshold_chars
+        if parallel:
+            executor = self._get_executor(self.max_workers)
+            results = executor.map(_split_offsets_worker, jobs, chunksize=max(1, len(jobs) // (self.max_workers * 4)))
+        else:
+            results = map(_split_offsets_worker, jobs)
+
+        for doc_id, flat in enumerate(results):
+            for i in range(0, len(flat), 2):
+                chunk_set.append(doc_id, flat[i], flat[i + 1])
+
+        self._record_stats("compact-parallel" if parallel else "compact", len(texts), len(chunk_set),
+                           total_chars, time.perf_counter() - start_time)
+        return chunk_set
+
+    def chunk_exact(self, documents: List[Document]) -> List[Document]:
+        """
+        Split documents with LangChain's RecursiveCharacterTextSplitter (the original
+        CreateChunks behavior)
+
+        Args:
+            documents: Documents to split
+
+        Returns:
+            List of chunk Documents with start_index metadata
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        start_time = time.perf_counter()
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            add_start_index=True
+        )
+        chunks = text_splitter.split_documents(documents)
+        self._record_stats("exact", len(documents), len(chunks),
+                           sum(len(doc.page_content) for doc in documents), time.perf_counter() - start_time)
+        return chunks
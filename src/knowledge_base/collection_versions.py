@@ -0,0 +1,79 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+class CollectionVersions:
+    """
+    Pointer to the active version of a logical collection (e.g. "lab_reports").
+
+    Full rebuilds are written into a new version next to the active one and only
+    become visible when activate() atomically rewrites the pointer file, so
+    readers never see an empty or half-built collection. Older versions stay
+    listed until they are garbage-collected, which is what rollback() uses.
+
+    Version 0 is the original, unversioned collection, so existing stores keep
+    working without a migration.
+    """
+
+    def __init__(self, pointer_path: str):
+        """
+        Args:
+            pointer_path: Path of the JSON pointer file
+        """
+        self.pointer_path = Path(pointer_path)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.pointer_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"active": 0, "versions": [0]}
+
+    def _write(self, state: dict):
+        """Replace the pointer file atomically"""
+        self.pointer_path.parent.mkdir(parents=True, exist_ok=True)
+        state["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        tmp_path = self.pointer_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.pointer_path)
+
+    @property
+    def active(self) -> int:
+        return self._read()["active"]
+
+    def versions(self) -> List[int]:
+        """All versions that still exist, oldest first"""
+        return sorted(self._read()["versions"])
+
+    def next_version(self) -> int:
+        """Reserve a version number for a rebuild (it is listed once activated)"""
+        state = self._read()
+        version = max(state["versions"] + [state.get("reserved", 0)]) + 1
+        state["reserved"] = version
+        self._write(state)
+        return version
+
+    def activate(self, version: int):
+        """Point the collection at version"""
+        state = self._read()
+        state["active"] = version
+        state["versions"] = sorted(set(state["versions"]) | {version})
+        self._write(state)
+
+    def previous(self) -> Optional[int]:
+        """Newest version older than the active one"""
+        state = self._read()
+        older = [version for version in state["versions"] if version < state["active"]]
+        return max(older) if older else None
+
+    def remove(self, version: int):
+        """Forget a version that was deleted"""
+        state = self._read()
+        if version == state["active"]:
+            raise ValueError(f"Cannot remove the active version {version}")
+        state["versions"] = [v for v in state["versions"] if v != version]
+        self._write(state)
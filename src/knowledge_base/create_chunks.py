@@ -1,8 +1,8 @@
 from typing import List, Optional
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
+from langchain_core.documents import Document
 from src import Logger
 from .data_ingestion import Ingestion
+from .chunking_engine import ChunkingEngine, ChunkSet
 
 
 class CreateChunks:
@@ -16,22 +16,30 @@ class CreateChunks:
     Attributes:
         chunk_size (int): The size of each text chunk in characters
         chunk_overlap (int): The number of characters to overlap between chunks
+        exact (bool): Whether chunks are built as LangChain Documents up front (the original
+            output) instead of as a compact, lazily materialized ChunkSet
+        engine (ChunkingEngine): Chunking engine doing the actual splitting
         logger (Logger): Logger instance for tracking operations
         lab_reports (List[Document]): List of loaded lab report documents
         prescriptions (List[Document]): List of loaded prescription documents
     """
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, exact: bool = False):
         """
         Initialize the CreateChunks class.
         
         Args:
             chunk_size (int, optional): Size of each chunk in characters. Defaults to 1000.
             chunk_overlap (int, optional): Overlap between chunks in characters. Defaults to 200.
+            exact (bool, optional): Return a list of LangChain Documents exactly as the
+                RecursiveCharacterTextSplitter builds them. Defaults to False, which returns a
+                ChunkSet: a Sequence of the same Documents, stored as offsets and built on access.
         """
         self.logger = Logger()
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.exact = exact
+        self.engine = ChunkingEngine(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
         
         try:
             self.logger.log_system("info", "Initializing document ingestion")
@@ -56,7 +64,8 @@ class CreateChunks:
             doc_type (str): Type of documents being processed ('lab_reports' or 'prescriptions')
             
         Returns:
-            List[Document]: List of document chunks with preserved metadata
+            List[Document]: List of document chunks with preserved metadata (a ChunkSet
+            unless exact=True)
         """
         try:
             self.logger.log_system("info", 
@@ -68,18 +77,15 @@ class CreateChunks:
                 self.logger.log_system("warning", f"No {doc_type} documents to process")
                 return []
             
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                add_start_index=True
-            )
-            
-            chunks = text_splitter.split_documents(documents)
+            if self.exact:
+                chunks = self.engine.chunk_exact(documents)
+            else:
+                chunks = self.engine.chunk(documents)
             
             # Log chunk statistics
             self.logger.log_system("info", 
                 f"Created {len(chunks)} chunks from {len(documents)} {doc_type}. "
-                f"Average chunk size: {sum(len(chunk.page_content) for chunk in chunks)/len(chunks):.2f} "
+                f"Average chunk size: {sum(self._chunk_sizes(chunks))/len(chunks):.2f} "
                 f"characters"
             )
             
@@ -89,6 +95,13 @@ class CreateChunks:
             self.logger.log_system("error", f"Error creating chunks for {doc_type}: {str(e)}")
             return []
 
+    @staticmethod
+    def _chunk_sizes(chunks: List[Document]) -> List[int]:
+        """Chunk lengths, read from offsets for a ChunkSet so no text is materialized"""
+        if isinstance(chunks, ChunkSet):
+            return chunks.sizes()
+        return [len(chunk.page_content) for chunk in chunks]
+
     def create_lab_report_chunks(self) -> List[Document]:
         """
         Create chunks from lab report documents.
@@ -121,7 +134,7 @@ class CreateChunks:
             if not chunks:
                 return {"total_chunks": 0, "avg_size": 0, "min_size": 0, "max_size": 0}
             
-            chunk_sizes = [len(chunk.page_content) for chunk in chunks]
+            chunk_sizes = self._chunk_sizes(chunks)
             stats = {
                 "total_chunks": len(chunks),
                 "avg_size": sum(chunk_sizes) / len(chunks),
@@ -1,137 +1,494 @@
-from typing import List, Dict, Optional, Set
+import json
+import os
+import shutil
+from typing import List, Dict, Optional, Set, Tuple
 from pathlib import Path
 from uuid import uuid4
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 from src.logging import Logger
+from src.initialize_embeddings import EmbeddingRegistry
+from src.profiling import ProfilingHooks
 from .create_chunks import CreateChunks
+from .chunking_engine import ChunkSet
+from .sharded_store import ShardedVectorStore
+from .source_index import SourceIndex, iter_pages, store_count
+from .collection_versions import CollectionVersions
+from .dedup import DuplicateIndex
+
+# Chunks are embedded and written in batches of this size; ChunkSet chunks are
+# only turned into strings one batch at a time
+ADD_BATCH_SIZE = 256
 
 class VectorStore:
     """
     Creates and manages Chroma vector stores using HuggingFace embeddings.
     Maintains separate collections for lab reports, prescriptions, and combined data.
+
+    With more than one shard (num_shards or the VECTOR_SHARDS environment variable),
+    each collection is a ShardedVectorStore partitioned by the VECTOR_SHARD_KEY
+    metadata field (default: "source") and searched across worker processes.
+
+    Full rebuilds are blue/green: the new chunks go into a fresh version of the
+    collection, which is verified and then activated by atomically switching the
+    collection's version pointer. The active version keeps serving queries
+    meanwhile and is kept afterwards (VECTOR_KEEP_VERSIONS, default 1) for rollback.
     """
     
-    def __init__(self):
+    def __init__(self, num_shards: Optional[int] = None):
+        """
+        Args:
+            num_shards: Number of shards per collection (default: VECTOR_SHARDS or 1, unsharded)
+        """
         self.logger = Logger()
+        self.num_shards = num_shards or int(os.getenv("VECTOR_SHARDS", "1"))
+        self.shard_key = os.getenv("VECTOR_SHARD_KEY", "source")
+        self.keep_versions = int(os.getenv("VECTOR_KEEP_VERSIONS", "1"))
+        # In shared serving mode, refreshes publish a generation for the serving workers
+        self.serving = os.getenv("INDEX_SERVING", "") == "shared"
         
         # Base path for vector stores
         self.base_persist_dir = Path("chroma_db")
         self.base_persist_dir.mkdir(parents=True, exist_ok=True)
         
-        # Initialize chunks creator
-        self.chunks = CreateChunks()
+        # Chunks creator, built on first use (loading it ingests every document)
+        self._chunks: Optional[CreateChunks] = None
         
-        # Initialize embedding model
-        self.embedding_model = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-mpnet-base-v2"
-        )
+        # source -> chunk ids of each collection, loaded on first use
+        self._source_indexes: Dict[str, SourceIndex] = {}
+        
+        # Collections already checked for a store left in the other (sharded/unsharded) layout
+        self._layout_checked: Set[str] = set()
+        
+        # Near-duplicate chunks reuse their canonical chunk's embedding instead of being embedded
+        self.dedup = os.getenv("DEDUP_ENABLED", "1") == "1"
+        self.dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+        self._dedup_indexes: Dict[str, DuplicateIndex] = {}
+        
+        # Sampling profiler for store refreshes when PROFILE_INDEXING=1
+        self.profiling = ProfilingHooks()
+        
+        # Shared embedding model, loaded once per process
+        self.embedding_model = EmbeddingRegistry.get()
         
         self.logger.log_system("info", "Initialized VectorStore")
 
-    def _get_persist_directory(self, collection_name: str) -> str:
-        """Get the persist directory for a collection"""
+    @property
+    def chunks(self) -> CreateChunks:
+        """Chunks creator; documents are only ingested when chunks are first needed"""
+        if self._chunks is None:
+            self._chunks = CreateChunks()
+        return self._chunks
+
+    def _get_persist_directory(self, collection_name: str, sharded: Optional[bool] = None) -> str:
+        """Get the persist directory for a (versioned) collection (default layout: the current one)"""
+        if self.num_shards > 1 if sharded is None else sharded:
+            return str(self.base_persist_dir / f"{collection_name}_sharded")
         return str(self.base_persist_dir / f"{collection_name}_collection")
 
-    def get_store(self, collection_name: str) -> Chroma:
-        """Get a Chroma store with the given collection name"""
-        persist_directory = self._get_persist_directory(collection_name)
+    def versions(self, collection_name: str, sharded: Optional[bool] = None) -> CollectionVersions:
+        """Get the version pointer of a logical collection (default layout: the current one)"""
+        suffix = "_sharded" if (self.num_shards > 1 if sharded is None else sharded) else ""
+        return CollectionVersions(str(self.base_persist_dir / f"{collection_name}{suffix}_versions.json"))
+
+    @staticmethod
+    def _versioned_name(collection_name: str, version: int) -> str:
+        # Version 0 is the original unversioned collection
+        return collection_name if version == 0 else f"{collection_name}__v{version}"
+
+    @staticmethod
+    def _logical_name(versioned_name: str) -> str:
+        return versioned_name.split("__v")[0]
+
+    def get_store(self, collection_name: str, version: Optional[int] = None) -> Chroma:
+        """
+        Get a Chroma store (or a sharded one when num_shards > 1) for a collection
+
+        Args:
+            collection_name: Logical collection name
+            version: Version to open (default: the active one)
+        """
+        if version is None:
+            self._migrate_layout(collection_name)
+            version = self.versions(collection_name).active
+        versioned_name = self._versioned_name(collection_name, version)
+        persist_directory = self._get_persist_directory(versioned_name)
+        if self.num_shards > 1:
+            return ShardedVectorStore.shared(
+                collection_name=versioned_name,
+                embedding_function=self.embedding_model,
+                persist_directory=persist_directory,
+                num_shards=self.num_shards,
+                shard_key=self.shard_key
+            )
+
         return Chroma(
-            collection_name=collection_name,
+            collection_name=versioned_name,
             embedding_function=self.embedding_model,
             persist_directory=persist_directory
         )
 
+    def _migrate_layout(self, collection_name: str, page_size: int = 1000):
+        """
+        Copy a collection kept in the other layout into this one, with its stored embeddings
+
+        Unsharded and sharded stores live in different directories, so switching
+        VECTOR_SHARDS between 1 and N would otherwise start from an empty store and
+        re-embed everything. This runs once, when the current layout has no store for
+        the collection yet; a ".migrating" marker makes an interrupted copy resume.
+        """
+        if collection_name in self._layout_checked:
+            return
+        self._layout_checked.add(collection_name)
+
+        sharded = self.num_shards > 1
+        target_directory = Path(self._get_persist_directory(collection_name))
+        marker = target_directory / ".migrating"
+        if self.versions(collection_name).pointer_path.exists() or (target_directory.exists() and not marker.exists()):
+            return
+        source_version = self.versions(collection_name, sharded=not sharded).active
+        source_name = self._versioned_name(collection_name, source_version)
+        source_directory = Path(self._get_persist_directory(source_name, sharded=not sharded))
+        if not source_directory.exists():
+            return
+
+        self.logger.log_system("info",
+            f"Copying {collection_name} version {source_version} from the "
+            f"{'unsharded' if sharded else 'sharded'} layout (no re-embedding)")
+        target_directory.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        copied = 0
+        try:
+            if sharded:
+                source = Chroma(collection_name=source_name, embedding_function=self.embedding_model,
+                                persist_directory=str(source_directory))
+            else:
+                # Open with the shard count and key it was written with, so nothing is rebalanced
+                manifest = json.loads((source_directory / "shards.json").read_text(encoding="utf-8"))
+                source = ShardedVectorStore.shared(
+                    collection_name=source_name,
+                    embedding_function=self.embedding_model,
+                    persist_directory=str(source_directory),
+                    num_shards=manifest["num_shards"],
+                    shard_key=manifest["shard_key"]
+                )
+            target = self.get_store(collection_name, 0)
+            for page in iter_pages(source, ["embeddings", "documents", "metadatas"], page_size):
+                documents = [Document(page_content=text, metadata=metadata or {})
+                             for text, metadata in zip(page["documents"], page["metadatas"])]
+                self._upsert(target, page["ids"], [[float(x) for x in embedding] for embedding in page["embeddings"]],
+                             documents)
+                copied += len(page["ids"])
+        except Exception as e:
+            # The marker stays, so the next process picks the copy up again
+            self.logger.log_system("error", f"Copying {collection_name} into the current layout failed: {str(e)}")
+            return
+        finally:
+            if not sharded:
+                ShardedVectorStore.release(str(source_directory))
+        marker.unlink()
+        self.logger.log_system("info", f"Copied {copied} chunks of {collection_name} into the current layout")
+
+    def source_index(self, collection_name: str) -> SourceIndex:
+        """Get the source -> chunk ids index kept next to a (versioned) collection"""
+        index = self._source_indexes.get(collection_name)
+        if index is None:
+            index = SourceIndex(str(Path(self._get_persist_directory(collection_name)) / "sources.json"))
+            self._source_indexes[collection_name] = index
+        return index
+
+    def dedup_index(self, collection_name: str) -> DuplicateIndex:
+        """Get the near-duplicate signature index kept next to a (versioned) collection"""
+        index = self._dedup_indexes.get(collection_name)
+        if index is None:
+            index = DuplicateIndex(str(Path(self._get_persist_directory(collection_name)) / "signatures.npz"),
+                                   threshold=self.dedup_threshold)
+            self._dedup_indexes[collection_name] = index
+        return index
+
+    @staticmethod
+    def _sources(documents: List[Document]) -> Set[str]:
+        """Distinct sources of a chunk list, without materializing ChunkSet chunks"""
+        if isinstance(documents, ChunkSet):
+            return documents.sources()
+        return {doc.metadata["source"] for doc in documents}
+
+    @staticmethod
+    def _source_at(documents: List[Document], index: int) -> Optional[str]:
+        if isinstance(documents, ChunkSet):
+            return documents.source(index)
+        return documents[index].metadata.get("source")
+
+    @staticmethod
+    def _text_at(documents: List[Document], index: int) -> str:
+        if isinstance(documents, ChunkSet):
+            return documents.text(index)
+        return documents[index].page_content
+
+    @staticmethod
+    def _upsert(store: Chroma, ids: List[str], embeddings: List[List[float]], documents: List[Document]):
+        """Write chunks with precomputed embeddings"""
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        if isinstance(store, ShardedVectorStore):
+            store.add_embeddings(ids, embeddings, texts, metadatas)
+        else:
+            store._collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+
+    def _add_deduplicated(self, store: Chroma, dedup: DuplicateIndex, documents: List[Document],
+                          ids: List[str]) -> int:
+        """
+        Add a batch, embedding only chunks that are not near-duplicates of an indexed chunk.
+        Duplicates are stored with their canonical chunk's embedding and share its (stable) dedup_group.
+
+        Returns:
+            Number of chunks linked to a canonical chunk instead of being embedded
+        """
+        # Id of the chunk whose embedding each chunk uses: itself, or its canonical chunk
+        groups, signatures = [], []
+        for doc, id_ in zip(documents, ids):
+            signature, numbers_key = dedup.hasher.signature(doc.page_content)
+            canonical_id = dedup.find(signature, numbers_key)
+            dedup.add(id_, signature, numbers_key, canonical_id)
+            groups.append(canonical_id or id_)
+            signatures.append((signature, numbers_key))
+            doc.metadata["dedup_group"] = dedup.group_of(id_)
+
+        to_embed = [i for i, group in enumerate(groups) if group == ids[i]]
+        vectors = dict(zip(
+            [ids[i] for i in to_embed],
+            self.embedding_model.embed_documents([documents[i].page_content for i in to_embed]) if to_embed else []
+        ))
+        # Canonical chunks from earlier batches or syncs: copy their stored embedding
+        stored = sorted({group for group in groups if group not in vectors})
+        if stored:
+            results = store.get(ids=stored, include=["embeddings"])
+            vectors.update({id_: [float(x) for x in embedding]
+                            for id_, embedding in zip(results["ids"], results["embeddings"])})
+        missing = [i for i, group in enumerate(groups) if group not in vectors]
+        if missing:
+            # Index and store disagree; embed these chunks themselves (as canonical chunks) rather than fail
+            for i, vector in zip(missing, self.embedding_model.embed_documents([documents[i].page_content for i in missing])):
+                vectors[ids[i]] = vector
+                groups[i] = ids[i]
+                dedup.remove([ids[i]])
+                dedup.add(ids[i], *signatures[i])
+                documents[i].metadata["dedup_group"] = ids[i]
+
+        self._upsert(store, ids, [vectors[group] for group in groups], documents)
+        return len(ids) - len(to_embed) - len(missing)
+
+    def _add_documents(self, store: Chroma, documents: List[Document], ids: List[str],
+                       indices: Optional[List[int]] = None):
+        """Embed and add documents (optionally only those at the given indices) in batches"""
+        index = self.source_index(store._collection_name)
+        dedup = self.dedup_index(store._collection_name).ensure(store) if self.dedup else None
+        if indices is None:
+            indices = range(len(documents))
+        linked = 0
+        try:
+            for start in range(0, len(indices), ADD_BATCH_SIZE):
+                batch = indices[start:start + ADD_BATCH_SIZE]
+                batch_ids = [ids[i] for i in batch]
+                batch_documents = [documents[i] for i in batch]
+                if dedup is None:
+                    store.add_documents(documents=batch_documents, ids=batch_ids)
+                else:
+                    linked += self._add_deduplicated(store, dedup, batch_documents, batch_ids)
+                index.add(batch_ids, [self._source_at(documents, i) for i in batch])
+        finally:
+            index.save()
+            if dedup is not None:
+                dedup.save()
+        if linked:
+            self.logger.log_system("info",
+                f"Linked {linked} near-duplicate chunks to canonical chunks instead of embedding them")
+
+    def _delete_chunks(self, store: Chroma, ids: List[str]):
+        """Delete chunks from a store and from its duplicate index"""
+        store.delete(ids=ids)
+        if self.dedup:
+            dedup = self.dedup_index(store._collection_name)
+            if dedup._loaded or dedup.load():
+                dedup.remove(ids)
+                dedup.save()
+
+    def begin_rebuild(self, collection_name: str) -> Tuple[int, Chroma]:
+        """
+        Open an empty new version of a collection to build into
+
+        Returns:
+            (version, store); queries keep using the active version until commit_rebuild()
+        """
+        version = self.versions(collection_name).next_version()
+        store = self.get_store(collection_name, version)
+        self.logger.log_system("info", f"Building {collection_name} version {version}")
+        return version, store
+
+    def _verify_store(self, store: Chroma, expected_count: int, sample_text: Optional[str]):
+        """
+        Check a rebuilt store's chunk count and that a sample chunk finds itself
+
+        A near-duplicate chunk shares its canonical chunk's embedding, so the top hit
+        may be another member of the sample's dedup_group; that counts as finding it.
+        """
+        count = store_count(store)
+        if count != expected_count:
+            raise RuntimeError(f"expected {expected_count} chunks, found {count}")
+        if sample_text:
+            hits = store.similarity_search(sample_text, k=1)
+            if hits and hits[0].page_content == sample_text:
+                return
+            group = hits[0].metadata.get("dedup_group") if hits else None
+            if group is None or sample_text not in store.get(where={"dedup_group": group},
+                                                             include=["documents"])["documents"]:
+                raise RuntimeError("sample query did not return the sample chunk")
+
+    def commit_rebuild(self, collection_name: str, version: int, store: Chroma,
+                       expected_count: int, sample_text: Optional[str] = None):
+        """
+        Verify a rebuilt version and atomically make it the active one
+
+        Args:
+            collection_name: Logical collection name
+            version: Version returned by begin_rebuild()
+            store: Store returned by begin_rebuild(), now filled
+            expected_count: Number of chunks the version must hold
+            sample_text: Text of one chunk, used as a sample query
+        """
+        try:
+            self._verify_store(store, expected_count, sample_text)
+        except Exception as e:
+            self.logger.log_system("error",
+                f"Verification of {collection_name} version {version} failed ({str(e)}); "
+                f"keeping version {self.versions(collection_name).active}")
+            self.drop_version(collection_name, version)
+            raise
+
+        versions = self.versions(collection_name)
+        previous = versions.active
+        versions.activate(version)
+        self.logger.log_system("info",
+            f"Activated {collection_name} version {version} ({expected_count} chunks), was {previous}")
+        self.collect_garbage(collection_name)
+
+    def drop_version(self, collection_name: str, version: int):
+        """Delete one inactive version of a collection from disk"""
+        versions = self.versions(collection_name)
+        if version == versions.active:
+            raise ValueError(f"Cannot drop the active version {version} of {collection_name}")
+
+        versioned_name = self._versioned_name(collection_name, version)
+        persist_directory = self._get_persist_directory(versioned_name)
+        if Path(persist_directory).exists():
+            try:
+                self.get_store(collection_name, version).delete_collection()
+            except Exception as e:
+                self.logger.log_system("warning", f"Error deleting collection {versioned_name}: {str(e)}")
+            ShardedVectorStore.release(persist_directory)
+            shutil.rmtree(persist_directory, ignore_errors=True)
+        self._source_indexes.pop(versioned_name, None)
+        self._dedup_indexes.pop(versioned_name, None)
+        if version in versions.versions():
+            versions.remove(version)
+        self.logger.log_system("info", f"Dropped {collection_name} version {version}")
+
+    def collect_garbage(self, collection_name: str):
+        """Drop all but the active and the keep_versions most recent other versions"""
+        versions = self.versions(collection_name)
+        active = versions.active
+        inactive = [version for version in versions.versions() if version != active]
+        for version in inactive[:max(0, len(inactive) - self.keep_versions)]:
+            self.drop_version(collection_name, version)
+
+    def rollback(self, collection_name: str) -> Chroma:
+        """Re-activate the version that was active before the current one"""
+        versions = self.versions(collection_name)
+        previous = versions.previous()
+        if previous is None:
+            raise ValueError(f"No earlier version of {collection_name} to roll back to")
+        current = versions.active
+        versions.activate(previous)
+        self.logger.log_system("info", f"Rolled back {collection_name} from version {current} to {previous}")
+        return self.get_store(collection_name)
+
+    def _rebuild_store(self, collection_name: str, documents: List[Document], ids: List[str]) -> Chroma:
+        """Build all documents into a new version and swap it in; the active version serves until then"""
+        version, store = self.begin_rebuild(collection_name)
+        try:
+            self._add_documents(store, documents, ids)
+        except Exception:
+            self.drop_version(collection_name, version)
+            raise
+        self.commit_rebuild(collection_name, version, store, len(documents),
+                            self._text_at(documents, len(documents) // 2))
+        return store
+
     def _sync_documents(self, store: Chroma, documents: List[Document], append: bool = True) -> Chroma:
         """Synchronize documents in the store with current file system state"""
         if not documents:
             if append:
                 try:
-                    existing_results = store.get()
-                    if existing_results and existing_results["ids"]:
+                    index = self.source_index(store._collection_name).ensure(store)
+                    existing_ids = index.all_ids()
+                    if existing_ids:
                         self.logger.log_system("info", "Clearing store as no documents exist in this category")
-                        store.delete(ids=existing_results["ids"])
+                        self._delete_chunks(store, existing_ids)
+                        index.clear()
+                        index.save()
                 except Exception as e:
                     self.logger.log_system("warning", f"Error clearing store: {str(e)}")
                 return store
             else:
                 # If not appending and no documents, just recreate empty collection
-                return self.get_store(store._collection_name)
+                return self.get_store(self._logical_name(store._collection_name))
 
         # Generate UUIDs for new documents
         doc_ids = [str(uuid4()) for _ in range(len(documents))]
 
         if not append:
-            # For non-append mode, recreate the collection and add all documents
-            collection_name = store._collection_name
-            persist_directory = self._get_persist_directory(collection_name)
-            
-            # Properly delete and recreate the store
-            try:
-                store.delete_collection()
-            except Exception as e:
-                self.logger.log_system("warning", f"Error deleting collection: {str(e)}")
-            
-            # Create new store and add documents
-            new_store = Chroma(
-                collection_name=collection_name,
-                embedding_function=self.embedding_model,
-                persist_directory=persist_directory
-            )
-            new_store.add_documents(documents=documents, ids=doc_ids)
-            return new_store
+            # For non-append mode, rebuild the collection as a new version and swap it in
+            return self._rebuild_store(self._logical_name(store._collection_name), documents, doc_ids)
 
         # Handle append mode
         try:
-            # Get existing documents and their metadata
-            existing_results = store.get()
-            if existing_results and existing_results["documents"]:
-                existing_docs = existing_results["documents"]
-                existing_metadata = existing_results["metadatas"]
-                existing_ids = existing_results["ids"]
-
+            # Existing sources come from the source index, not from reading every chunk
+            index = self.source_index(store._collection_name).ensure(store)
+            if len(index):
                 # Create sets for efficient lookup
-                current_sources = {doc.metadata["source"] for doc in documents}
-                existing_sources = {meta["source"] for meta in existing_metadata if meta and "source" in meta}
+                current_sources = self._sources(documents)
+                existing_sources = set(index.sources())
 
                 # Find documents to remove (sources that no longer exist)
                 sources_to_remove = existing_sources - current_sources
                 if sources_to_remove:
-                    ids_to_remove = [
-                        id_ for id_, meta in zip(existing_ids, existing_metadata)
-                        if meta.get("source") in sources_to_remove
-                    ]
+                    ids_to_remove = index.ids_for(sources_to_remove)
                     if ids_to_remove:
                         self.logger.log_system("info", 
                             f"Removing {len(ids_to_remove)} chunks from {len(sources_to_remove)} moved/deleted files")
-                        store.delete(ids=ids_to_remove)
-
-                # Find new documents to add
-                new_docs = []
-                new_ids = []
-                for doc, doc_id in zip(documents, doc_ids):
-                    # Check if this exact source is already in the store
-                    if doc.metadata["source"] not in existing_sources:
-                        new_docs.append(doc)
-                        new_ids.append(doc_id)
+                        self._delete_chunks(store, ids_to_remove)
+                    index.remove_sources(sources_to_remove)
+                    index.save()
+
+                # Find new documents to add (sources not already in the store)
+                new_indices = [
+                    i for i in range(len(documents))
+                    if self._source_at(documents, i) not in existing_sources
+                ]
                 
-                if new_docs:
-                    self.logger.log_system("info", f"Adding {len(new_docs)} new chunks")
-                    store.add_documents(documents=new_docs, ids=new_ids)
+                if new_indices:
+                    self.logger.log_system("info", f"Adding {len(new_indices)} new chunks")
+                    self._add_documents(store, documents, doc_ids, new_indices)
                 else:
                     self.logger.log_system("info", "No new chunks to add")
             else:
                 # If store is empty, add all documents
                 self.logger.log_system("info", f"Adding {len(documents)} chunks to empty store")
-                store.add_documents(documents=documents, ids=doc_ids)
+                self._add_documents(store, documents, doc_ids)
         except Exception as e:
             self.logger.log_system("error", f"Error during sync: {str(e)}")
-            # If sync fails, recreate the store
-            store.delete_collection()
-            new_store = self.get_store(store._collection_name)
-            new_store.add_documents(documents=documents, ids=doc_ids)
-            return new_store
+            # If sync fails, rebuild the store; the current version serves until the rebuild is verified
+            return self._rebuild_store(self._logical_name(store._collection_name), documents, doc_ids)
 
         return store
 
@@ -159,12 +516,13 @@ class VectorStore:
         """Create or update combined vector store"""
         try:
             all_docs = self.chunks.process_all_documents()
-            chunks = []
+            parts = [all_docs[key] for key in ("lab_report_chunks", "prescription_chunks") if all_docs.get(key)]
             
-            if "lab_report_chunks" in all_docs:
-                chunks.extend(all_docs["lab_report_chunks"])
-            if "prescription_chunks" in all_docs:
-                chunks.extend(all_docs["prescription_chunks"])
+            if parts and all(isinstance(part, ChunkSet) for part in parts):
+                # Stays compact: shares the source texts instead of materializing chunks
+                chunks = ChunkSet.concat(parts)
+            else:
+                chunks = [chunk for part in parts for chunk in part]
             
             store = self.get_store("combined")
             # Use append mode to maintain the existing store and only update changed documents
@@ -175,39 +533,42 @@ class VectorStore:
 
     def create_all_stores(self) -> Dict[str, Optional[Chroma]]:
         """Create or update all vector stores"""
-        return {
-            "lab_reports": self.create_lab_reports_store(),
-            "prescriptions": self.create_prescriptions_store(),
-            "combined": self.create_combined_store()
-        }
+        with self.profiling.profile("refresh", self.profiling.indexing):
+            stores = {
+                "lab_reports": self.create_lab_reports_store(),
+                "prescriptions": self.create_prescriptions_store(),
+                "combined": self.create_combined_store()
+            }
+            if self.serving:
+                from .shared_index import IndexPublisher
+                IndexPublisher(self).publish()
+            return stores
 
     def _print_store_stats(self, store_name: str, store: Chroma):
         """Print statistics about a vector store"""
-        results = store.get()
-        if not results:
+        index = self.source_index(store._collection_name).ensure(store)
+        if not len(index):
             print(f"\n{store_name} Store is empty")
             return
             
-        docs = results['documents']
-        metadatas = results['metadatas']
-        
-        # Count unique sources
-        sources = {meta["source"] for meta in metadatas if meta and "source" in meta}
-        
-        # Count chunks per source
-        chunks_per_source = {}
-        for doc, meta in zip(docs, metadatas):
-            source = meta.get("source", "unknown")
-            chunks_per_source[source] = chunks_per_source.get(source, 0) + 1
+        # Chunks per source, straight from the source index
+        chunks_per_source = index.counts()
         
         print(f"\n{store_name} Store Statistics:")
-        print(f"Total source files: {len(sources)}")
-        print(f"Total chunks: {len(docs)}")
+        print(f"Total source files: {len(chunks_per_source)}")
+        print(f"Total chunks: {len(index)}")
         print("\nSource files and their chunks:")
-        for source in sorted(sources):
+        for source in sorted(chunks_per_source):
             print(f"  - {source}: {chunks_per_source[source]} chunks")
 
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 3 and sys.argv[1] == "rollback":
+        # Usage: python -m src.knowledge_base.create_vector_store rollback <collection>
+        VectorStore().rollback(sys.argv[2])
+        sys.exit(0)
+
     print("\nStarting Vector Store Creation/Update")
     print("====================================")
     
@@ -1,15 +1,19 @@
+import os
 from pathlib import Path
 from typing import List
-import pandas as pd
-from PIL import Image
-import pytesseract
-from langchain.docstore.document import Document
-from langchain_community.document_loaders import (
-    TextLoader,
-    PyPDFLoader,
-    CSVLoader,
-)
+from langchain_core.documents import Document
 from src.logging import Logger
+from src.profiling import ProfilingHooks
+from .ocr import OCRProcessor
+from .tabular_loaders import TabularLoader
+from .lab_results import LabResultIndex
+from .dedup import drop_duplicate_documents
+
+# The langchain_community loaders are imported in the branch that needs them, so
+# loading e.g. only .txt files never imports them
+
+# PDF pages with less extracted text than this are treated as scanned and OCRed
+MIN_PDF_PAGE_TEXT_CHARS = 20
 
 
 class Ingestion: 
@@ -20,11 +24,19 @@ class Ingestion:
             self.logger.log_system("info", "Logger object initialized successfully")
         else:
             self.logger.log_system("error", "Logger object failed to initialize")
+        self.ocr = OCRProcessor()
+        self.tabular = TabularLoader()
+        # tracemalloc around each directory load when PROFILE_INDEXING=1
+        self.profiling = ProfilingHooks()
+        # Skip near-duplicate documents (same report uploaded twice, e.g. as PDF and as photo)
+        self.dedup = os.getenv("DEDUP_ENABLED", "1") == "1"
+        self.dedup_threshold = float(os.getenv("DEDUP_DOCUMENT_THRESHOLD", "0.85"))
 
 
     def load_documents_from_dir(self, directory_path: str, file_types: List[str]) -> List[Document]:
         """
-        Loads documents from a directory using LangChain loaders and pandas for Excel.
+        Loads documents from a directory using LangChain loaders, streaming row-grouped
+        loaders for Excel/CSV and OCR for images and scanned PDF pages.
 
         Args:
             directory_path (str): Path to directory containing files.
@@ -34,10 +46,16 @@ class Ingestion:
             List[Document]: A list of LangChain Document objects.
         """
         self.logger.log_system("info", f"Starting to load documents from: {directory_path}")
-        supported_images = {'.png', '.jpg', '.jpeg'}
+        supported_images = {'.png', '.jpg', '.jpeg', '.tif', '.tiff'}
         documents = []
-
-        for file_path in Path(directory_path).rglob("*"):
+        # Image pages are OCRed in parallel on the OCR pool; (position, path, page futures)
+        pending_images = []
+        # Scanned PDF pages already have a Document, only their text is filled in; (doc, future)
+        pending_pdf_pages = []
+
+        # Sorted so the load order, and with it which copy of a near-duplicate document is
+        # kept, does not depend on filesystem order
+        for file_path in sorted(Path(directory_path).rglob("*")):
             file_ext = file_path.suffix.lower()
 
             try:
@@ -49,36 +67,33 @@ class Ingestion:
                 docs = []
 
                 if file_ext == '.txt':
+                    from langchain_community.document_loaders import TextLoader
                     loader = TextLoader(str(file_path), autodetect_encoding=True)
                     docs = loader.load()
 
                 elif file_ext == '.pdf':
+                    from langchain_community.document_loaders import PyPDFLoader
                     loader = PyPDFLoader(str(file_path))
                     docs = loader.load()
 
-                elif file_ext == '.xlsx':
-                    df = pd.read_excel(file_path)
-                    content = df.to_string(index=False)
-                    doc = Document(page_content=content, metadata={"source": str(file_path)})
-                    docs = [doc]
+                    # Pages without a text layer are scans: OCR them page by page
+                    scanned = {
+                        doc.metadata.get("page", i): doc for i, doc in enumerate(docs)
+                        if len(doc.page_content.strip()) < MIN_PDF_PAGE_TEXT_CHARS
+                    }
+                    if scanned:
+                        futures = self.ocr.submit_pdf_pages(str(file_path), list(scanned))
+                        pending_pdf_pages.extend((scanned[page], future) for page, future in futures.items())
 
-                elif file_ext == '.csv':
-                    loader = CSVLoader(str(file_path))
-                    docs = loader.load()
+                elif file_ext in ('.xlsx', '.csv'):
+                    # Streamed row by row and grouped along row boundaries
+                    docs = self.tabular.load(str(file_path))
 
              
                 elif file_ext in supported_images:
-    
-                    try:
-                        self.logger.log_system("info" , "starting to decode the image")
-                        image = Image.open(file_path)
-                        text = pytesseract.image_to_string(image)
-                        doc = Document(page_content=text, metadata={"source": str(file_path)})
-                        docs = [doc]
-                    
-                    except Exception as img_error:
-                        self.logger.log_system("error", f"Image OCR failed for {file_path}: {img_error}")
-                        continue
+                    self.logger.log_system("info" , "queueing the image for OCR")
+                    pending_images.append((len(documents), file_path, self.ocr.submit_image_pages(str(file_path))))
+                    continue
 
                 else:
                     self.logger.log_system("warning", f"Unsupported file format: {file_path}")
@@ -90,6 +105,28 @@ class Ingestion:
             except Exception as e:
                 self.logger.log_system("error", f"Skipped file {file_path} due to error: {e}")
 
+        for doc, future in pending_pdf_pages:
+            try:
+                doc.page_content = future.result()
+                doc.metadata["ocr"] = True
+            except Exception as page_error:
+                self.logger.log_system("error",
+                    f"OCR failed for page {doc.metadata.get('page')} of {doc.metadata.get('source')}: {page_error}")
+
+        # Insert image pages back at their original positions; going in reverse keeps
+        # the earlier positions valid
+        for position, file_path, futures in reversed(pending_images):
+            docs = []
+            for page, future in enumerate(futures):
+                try:
+                    text = future.result()
+                except Exception as img_error:
+                    self.logger.log_system("error", f"Image OCR failed for page {page} of {file_path}: {img_error}")
+                    continue
+                docs.append(Document(page_content=text, metadata={"source": str(file_path), "page": page}))
+            documents[position:position] = docs
+            self.logger.log_system("info", f"Loaded {len(docs)} documents from {file_path}")
+
         self.logger.log_system("info", f"Total documents loaded: {len(documents)}")
         return documents
 
@@ -97,21 +134,44 @@ class Ingestion:
     def load_lab_reports(self) -> List[Document]:
         try:
             self.logger.log_system("info", "Initializing loading data from load_lab_reports")
-            docs = self.load_documents_from_dir("docs/lab_reports", ['.txt', '.pdf', '.xlsx', '.csv'])
+            with self.profiling.trace_allocations("ingest-lab_reports"):
+                docs = self.load_documents_from_dir("docs/lab_reports", ['.txt', '.pdf', '.xlsx', '.csv'])
+            docs = self._drop_duplicates(docs)
             if docs:
                 self.logger.log_system("info", f"Successfully loaded {len(docs)} lab reports")
             else:
                 self.logger.log_system("warning", "No lab reports found in the directory.")
+            self._index_lab_results(docs)
             return docs
         except Exception as e:
             self.logger.log_system("error", f"Failed to load lab reports: {e}")
             return []
 
 
+    def _drop_duplicates(self, docs: List[Document]) -> List[Document]:
+        """Keep only the first copy of near-duplicate documents"""
+        if not self.dedup:
+            return docs
+        kept = drop_duplicate_documents(docs, self.dedup_threshold)
+        if len(kept) < len(docs):
+            self.logger.log_system("info", f"Skipped {len(docs) - len(kept)} near-duplicate documents")
+        return kept
+
+
+    def _index_lab_results(self, docs: List[Document]):
+        """Rebuild the structured lab result table used for exact analyte lookups"""
+        try:
+            LabResultIndex().build(docs)
+        except Exception as e:
+            self.logger.log_system("error", f"Failed to index lab results: {e}")
+
+
     def load_prescriptions(self) -> List[Document]:
         try:
             self.logger.log_system("info", "Initializing loading data from load_prescriptions")
-            docs = self.load_documents_from_dir("docs/prescriptions", ['.txt', '.pdf', '.xlsx'])
+            with self.profiling.trace_allocations("ingest-prescriptions"):
+                docs = self.load_documents_from_dir("docs/prescriptions", ['.txt', '.pdf', '.xlsx'])
+            docs = self._drop_duplicates(docs)
             if docs:
                 self.logger.log_system("info", f"Successfully loaded {len(docs)} prescriptions")
             else:
@@ -0,0 +1,300 @@
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from src.logging import Logger
+from .source_index import iter_pages, store_count
+
+
+# Modulus of the MinHash permutations; a, b and the shingle hashes are all below
+# 2**32, so a * h + b fits in uint64 without overflow
+_MERSENNE_PRIME = (1 << 61) - 1
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+class MinHasher:
+    """
+    MinHash signatures over character shingles of normalized text.
+
+    Text is lowercased and reduced to letters and digits separated by single
+    spaces before shingling, so spacing, punctuation and line breaks (which
+    differ between a PDF's text layer and OCR of a photo of it) do not matter.
+
+    Every signature also carries a hash of the numbers in the text. Two texts are
+    only ever treated as duplicates if their numbers match exactly, so reports
+    that share a template but differ in a result, date or dose are never merged.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        """
+        Args:
+            num_perm: Number of hash permutations (signature length) (default: 64)
+            shingle_size: Shingle length in characters (default: 5)
+            seed: Seed of the permutations; signatures are only comparable with the same seed
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+
+    def numbers_key(self, text: str) -> int:
+        """Hash of the numbers in text, in order"""
+        return zlib.crc32(" ".join(_NUMBER.findall(text)).encode("utf-8"))
+
+    def signature(self, text: str) -> Tuple[np.ndarray, int]:
+        """
+        Compute the MinHash signature of a text
+
+        Returns:
+            (signature as uint32[num_perm], numbers key)
+        """
+        normalized = _NON_WORD.sub(" ", text.lower()).strip()
+        size = self.shingle_size
+        shingles = {normalized[i:i + size] for i in range(max(1, len(normalized) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32), self.numbers_key(text)
+
+
+class DuplicateIndex:
+    """
+    Near-duplicate index of MinHash signatures with LSH banding.
+
+    Every entry is either canonical or linked to a canonical entry. find() only
+    matches canonical entries: candidates come from LSH buckets (bands of rows
+    of the signature, plus the numbers key) and are accepted when their estimated
+    Jaccard similarity reaches threshold. When a canonical entry is removed, its
+    first remaining duplicate becomes canonical in its place.
+
+    Every entry also has a group id: the id of the group's first canonical entry.
+    It never changes, not even when that entry is removed and a duplicate is
+    promoted, so the dedup_group stored with each chunk stays the same for the
+    whole group.
+
+    With an index_path the index is persisted as a single .npz file (signatures,
+    numbers keys, ids, links and group ids) written atomically.
+    """
+
+    def __init__(self, index_path: Optional[str] = None, threshold: float = 0.9,
+                 num_perm: int = 64, bands: int = 16):
+        """
+        Args:
+            index_path: Path of the .npz file, or None for an in-memory index
+            threshold: Minimum estimated Jaccard similarity of a duplicate (default: 0.9)
+            num_perm: Signature length (default: 64)
+            bands: Number of LSH bands; num_perm must be divisible by it (default: 16)
+        """
+        self.logger = Logger()
+        self.index_path = Path(index_path) if index_path else None
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.numbers: Dict[str, int] = {}
+        # duplicate id -> canonical id; canonical entries are not in here
+        self.canonical: Dict[str, str] = {}
+        self.groups: Dict[str, str] = {}
+        self._buckets: Dict[tuple, List[str]] = {}
+        self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _bucket_keys(self, signature: np.ndarray, numbers_key: int):
+        for band in range(self.bands):
+            yield band, numbers_key, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _index_canonical(self, entry_id: str):
+        for key in self._bucket_keys(self.signatures[entry_id], self.numbers[entry_id]):
+            self._buckets.setdefault(key, []).append(entry_id)
+
+    def _unindex_canonical(self, entry_id: str):
+        for key in self._bucket_keys(self.signatures[entry_id], self.numbers[entry_id]):
+            bucket = self._buckets.get(key)
+            if bucket and entry_id in bucket:
+                bucket.remove(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find(self, signature: np.ndarray, numbers_key: int) -> Optional[str]:
+        """Most similar canonical entry at or above threshold, if any"""
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for key in self._bucket_keys(signature, numbers_key):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = float(np.mean(self.signatures[candidate] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, entry_id: str, signature: np.ndarray, numbers_key: int, canonical_id: Optional[str] = None,
+            group: Optional[str] = None):
+        """Add an entry, canonical unless canonical_id is given; it joins canonical_id's group unless group is given"""
+        self.signatures[entry_id] = signature
+        self.numbers[entry_id] = numbers_key
+        if group is None:
+            group = self.group_of(canonical_id) if canonical_id is not None else entry_id
+        self.groups[entry_id] = group
+        if canonical_id is None:
+            self._index_canonical(entry_id)
+        else:
+            self.canonical[entry_id] = canonical_id
+
+    def group_of(self, entry_id: str) -> str:
+        """Stable group id of an entry (its dedup_group)"""
+        return self.groups.get(entry_id, entry_id)
+
+    def remove(self, entry_ids: List[str]):
+        """Remove entries, promoting a surviving duplicate for each removed canonical entry"""
+        removed = set(entry_ids)
+        for entry_id in removed:
+            if entry_id in self.signatures and entry_id not in self.canonical:
+                self._unindex_canonical(entry_id)
+        for entry_id in removed:
+            self.signatures.pop(entry_id, None)
+            self.numbers.pop(entry_id, None)
+            self.canonical.pop(entry_id, None)
+            self.groups.pop(entry_id, None)
+
+        orphans: Dict[str, List[str]] = {}
+        for duplicate, canonical in self.canonical.items():
+            if canonical in removed:
+                orphans.setdefault(canonical, []).append(duplicate)
+        for duplicates in orphans.values():
+            promoted = duplicates[0]
+            del self.canonical[promoted]
+            self._index_canonical(promoted)
+            for duplicate in duplicates[1:]:
+                self.canonical[duplicate] = promoted
+
+    def clear(self):
+        self.signatures, self.numbers, self.canonical, self.groups, self._buckets = {}, {}, {}, {}, {}
+
+    def load(self) -> bool:
+        """Load the index from disk; returns False if there is none"""
+        if self.index_path is None:
+            return False
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                ids = data["ids"].tolist()
+                signatures = data["signatures"]
+                numbers = data["numbers"].tolist()
+                canonical = data["canonical"].tolist()
+                # Indexes saved before group ids existed: the group was the canonical id
+                groups = data["groups"].tolist() if "groups" in data.files else [
+                    ids[row] if row >= 0 else entry_id for entry_id, row in zip(ids, canonical)]
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+        self.clear()
+        for row, entry_id in enumerate(ids):
+            self.signatures[entry_id] = signatures[row]
+            self.numbers[entry_id] = numbers[row]
+            self.groups[entry_id] = groups[row]
+        for row, entry_id in enumerate(ids):
+            if canonical[row] >= 0:
+                self.canonical[entry_id] = ids[canonical[row]]
+            else:
+                self._index_canonical(entry_id)
+        self._loaded = True
+        return True
+
+    def save(self):
+        """Write the index to index_path atomically"""
+        if self.index_path is None:
+            return
+        ids = list(self.signatures)
+        rows = {entry_id: row for row, entry_id in enumerate(ids)}
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            ids=np.array(ids, dtype=str),
+            signatures=np.array([self.signatures[entry_id] for entry_id in ids],
+                                dtype=np.uint32).reshape(len(ids), self.hasher.num_perm),
+            numbers=np.array([self.numbers[entry_id] for entry_id in ids], dtype=np.uint32),
+            canonical=np.array([rows.get(self.canonical.get(entry_id), -1) for entry_id in ids], dtype=np.int64),
+            groups=np.array([self.group_of(entry_id) for entry_id in ids], dtype=str),
+        )
+        os.replace(tmp_path, self.index_path)
+        self._loaded = True
+
+    def rebuild(self, store, page_size: int = 1000):
+        """Rebuild the index from the store's chunk texts, one page at a time, keeping stored group ids"""
+        self.clear()
+        for page in iter_pages(store, ["documents", "metadatas"], page_size):
+            for entry_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                signature, numbers_key = self.hasher.signature(text or "")
+                self.add(entry_id, signature, numbers_key, self.find(signature, numbers_key),
+                         (metadata or {}).get("dedup_group"))
+        self.save()
+        self.logger.log_system("info",
+            f"Rebuilt duplicate index {self.index_path}: {len(self)} chunks, {len(self.canonical)} duplicates")
+
+    def ensure(self, store) -> "DuplicateIndex":
+        """Make sure the index is loaded and covers every chunk of the store, rebuilding it if not"""
+        if not self._loaded:
+            self.load()
+        if len(self) != store_count(store):
+            self.rebuild(store)
+        return self
+
+
+def drop_duplicate_documents(documents: List[Document], threshold: float = 0.85) -> List[Document]:
+    """
+    Keep the first of each group of near-duplicate documents (e.g. the same report
+    uploaded as a PDF and as a photo)
+
+    Args:
+        documents: Loaded documents (pages), in load order
+        threshold: Minimum estimated Jaccard similarity of a duplicate (default: 0.85,
+            lower than for chunks to tolerate OCR noise)
+
+    Returns:
+        Documents without near-duplicates; kept documents are unchanged
+    """
+    index = DuplicateIndex(threshold=threshold)
+    kept = []
+    for position, document in enumerate(documents):
+        if not document.page_content.strip():
+            kept.append(document)
+            continue
+        signature, numbers_key = index.hasher.signature(document.page_content)
+        match = index.find(signature, numbers_key)
+        if match is None:
+            index.add(str(position), signature, numbers_key)
+            kept.append(document)
+        else:
+            canonical = documents[int(match)].metadata
+            index.logger.log_system("info",
+                f"Skipping {document.metadata.get('source')} (page {document.metadata.get('page', '-')}): "
+                f"near-duplicate of {canonical.get('source')} (page {canonical.get('page', '-')})")
+    return kept
+
+
+def collapse_duplicates(documents: List[Document], k: int) -> List[Document]:
+    """
+    Keep the best-ranked chunk of each duplicate group, up to k chunks
+
+    Chunks are grouped by their dedup_group metadata and by exact text (which also
+    covers chunks indexed before deduplication existed).
+    """
+    collapsed, seen = [], set()
+    for document in documents:
+        keys = {document.metadata.get("dedup_group"), document.page_content} - {None}
+        if keys & seen:
+            continue
+        seen |= keys
+        collapsed.append(document)
+        if len(collapsed) == k:
+            break
+    return collapsed
@@ -0,0 +1,296 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from array import array
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, Optional
+from src.logging import Logger
+from src.initialize_embeddings.load_embeddings import DEFAULT_MODEL_NAME
+from .create_vector_store import VectorStore
+from .sharded_store import ShardedVectorStore
+from .source_index import iter_pages
+
+
+SNAPSHOT_FORMAT_VERSION = 1
+COLLECTIONS = ["lab_reports", "prescriptions", "combined"]
+
+
+def _is_safe_member_name(name: str) -> bool:
+    """Whether an archive member name stays inside the extraction directory"""
+    path = PurePosixPath(name)
+    return bool(name) and "\\" not in name and not path.is_absolute() and ".." not in path.parts
+
+
+class IndexSnapshot:
+    """
+    Exports and restores the whole index as a single versioned, checksummed archive.
+
+    The archive (an uncompressed tar) contains, per collection, the chunk ids,
+    texts and metadata (gzipped JSON lines) and the embeddings as raw little-endian
+    float32, plus the OCR cache, the lab result index and a manifest of the files
+    under docs/ (path, size, SHA-256). snapshot.json records the format version,
+    embedding model, dimensions, counts and a SHA-256 for every member.
+
+    Restoring writes the stored embeddings in bulk into a new version of each
+    collection, so nothing is re-embedded, and activates it once verified; the
+    current version keeps serving until then. With the OCR cache restored and the stores already
+    holding every source, the next sync finds nothing new to OCR or embed.
+    """
+
+    def __init__(self, num_shards: Optional[int] = None, page_size: int = 1000,
+                 docs_dir: str = "docs", ocr_cache_dir: str = "ocr_cache",
+                 lab_index_path: str = "lab_index/lab_results.json"):
+        """
+        Args:
+            num_shards: Shard layout of the stores (default: VECTOR_SHARDS or 1)
+            page_size: Number of chunks read or written per batch (default: 1000)
+            docs_dir: Document directory described by the manifest (default: "docs")
+            ocr_cache_dir: OCR cache directory to include (default: "ocr_cache")
+            lab_index_path: Lab result index to include (default: "lab_index/lab_results.json")
+        """
+        self.logger = Logger()
+        self.vector_store = VectorStore(num_shards=num_shards)
+        self.page_size = page_size
+        self.docs_dir = Path(docs_dir)
+        self.ocr_cache_dir = Path(ocr_cache_dir)
+        self.lab_index_path = Path(lab_index_path)
+
+    @staticmethod
+    def _sha256_file(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _docs_manifest(self) -> List[dict]:
+        """Describe the source documents the index was built from"""
+        if not self.docs_dir.exists():
+            return []
+        return [
+            {"path": str(path), "size": path.stat().st_size, "sha256": self._sha256_file(path)}
+            for path in sorted(self.docs_dir.rglob("*")) if path.is_file()
+        ]
+
+    def _export_collection(self, store, work_dir: Path, name: str) -> dict:
+        """Write one collection's chunks and embeddings into work_dir"""
+        chunks_path = work_dir / f"collections/{name}/chunks.jsonl.gz"
+        embeddings_path = work_dir / f"collections/{name}/embeddings.f32"
+        chunks_path.parent.mkdir(parents=True, exist_ok=True)
+
+        count, dimensions = 0, 0
+        with gzip.open(chunks_path, "wt", encoding="utf-8") as chunks_file, open(embeddings_path, "wb") as embeddings_file:
+            for page in iter_pages(store, ["embeddings", "documents", "metadatas"], self.page_size):
+                for chunk_id, document, metadata, embedding in zip(
+                        page["ids"], page["documents"], page["metadatas"], page["embeddings"]):
+                    chunks_file.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n")
+                    vector = array("f", embedding)
+                    if sys.byteorder != "little":
+                        vector.byteswap()
+                    embeddings_file.write(vector.tobytes())
+                    dimensions = dimensions or len(vector)
+                    count += 1
+        return {"count": count, "dimensions": dimensions}
+
+    def export(self, archive_path: str) -> dict:
+        """
+        Write a snapshot of all collections and ingestion state
+
+        Args:
+            archive_path: Where to write the archive (written atomically)
+
+        Returns:
+            The snapshot manifest (contents of snapshot.json)
+        """
+        start = time.perf_counter()
+        archive_path = Path(archive_path)
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            work_dir = Path(tmp)
+            collections = {}
+            for name in COLLECTIONS:
+                collections[name] = self._export_collection(self.vector_store.get_store(name), work_dir, name)
+                self.logger.log_system("info", f"Snapshot: exported {collections[name]['count']} chunks from {name}")
+
+            (work_dir / "docs_manifest.json").write_text(json.dumps(self._docs_manifest()), encoding="utf-8")
+            if self.lab_index_path.exists():
+                shutil.copy2(self.lab_index_path, work_dir / "lab_results.json")
+            if self.ocr_cache_dir.exists():
+                shutil.copytree(self.ocr_cache_dir, work_dir / "ocr_cache",
+                                ignore=shutil.ignore_patterns("*.tmp"))
+
+            members = sorted(str(path.relative_to(work_dir)) for path in work_dir.rglob("*") if path.is_file())
+            manifest = {
+                "format_version": SNAPSHOT_FORMAT_VERSION,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "embedding_model": DEFAULT_MODEL_NAME,
+                "num_shards": self.vector_store.num_shards,
+                "collections": collections,
+                "checksums": {member: self._sha256_file(work_dir / member) for member in members},
+            }
+
+            tmp_archive = archive_path.with_name(archive_path.name + ".tmp")
+            with tarfile.open(tmp_archive, "w") as tar:
+                # snapshot.json goes first so a restore can validate before reading anything else
+                data = json.dumps(manifest, indent=2).encode("utf-8")
+                info = tarfile.TarInfo("snapshot.json")
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+                for member in members:
+                    tar.add(work_dir / member, arcname=member)
+            os.replace(tmp_archive, archive_path)
+
+        self.logger.log_system("info",
+            f"Snapshot written to {archive_path} ({archive_path.stat().st_size / 1e6:.1f}MB) "
+            f"in {time.perf_counter() - start:.1f}s")
+        return manifest
+
+    def _verify(self, work_dir: Path, manifest: dict):
+        """Reject snapshots from another format/model or with corrupted members"""
+        if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version: {manifest.get('format_version')}")
+        if manifest.get("embedding_model") != DEFAULT_MODEL_NAME:
+            raise ValueError(
+                f"Snapshot embeddings come from {manifest.get('embedding_model')}, "
+                f"but this build uses {DEFAULT_MODEL_NAME}")
+        for member, checksum in manifest["checksums"].items():
+            path = work_dir / member
+            if not path.is_file() or self._sha256_file(path) != checksum:
+                raise ValueError(f"Snapshot member {member} is missing or corrupted")
+
+    def _iter_snapshot_rows(self, work_dir: Path, name: str, dimensions: int) -> Iterator[tuple]:
+        """Yield (id, document, metadata, embedding) for one collection of an extracted snapshot"""
+        record_size = dimensions * 4
+        with gzip.open(work_dir / f"collections/{name}/chunks.jsonl.gz", "rt", encoding="utf-8") as chunks_file, \
+                open(work_dir / f"collections/{name}/embeddings.f32", "rb") as embeddings_file:
+            for line in chunks_file:
+                row = json.loads(line)
+                vector = array("f")
+                vector.frombytes(embeddings_file.read(record_size))
+                if sys.byteorder != "little":
+                    vector.byteswap()
+                yield row["id"], row["document"], row["metadata"], vector.tolist()
+
+    def _restore_collection(self, work_dir: Path, name: str, info: dict):
+        """Load a collection from the snapshot into a new version, in bulk and without embedding, and activate it"""
+        version, store = self.vector_store.begin_rebuild(name)
+        index = self.vector_store.source_index(store._collection_name)
+        index.clear()
+        sample_text = None
+
+        batch: Dict[str, list] = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+
+        def flush():
+            if not batch["ids"]:
+                return
+            if isinstance(store, ShardedVectorStore):
+                store.add_embeddings(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+            else:
+                store._collection.upsert(ids=batch["ids"], embeddings=batch["embeddings"],
+                                         documents=batch["documents"], metadatas=batch["metadatas"])
+            index.add(batch["ids"], [(metadata or {}).get("source") for metadata in batch["metadatas"]])
+            for values in batch.values():
+                values.clear()
+
+        try:
+            for chunk_id, document, metadata, embedding in self._iter_snapshot_rows(work_dir, name, info["dimensions"]):
+                sample_text = sample_text or document
+                batch["ids"].append(chunk_id)
+                batch["documents"].append(document)
+                batch["metadatas"].append(metadata)
+                batch["embeddings"].append(embedding)
+                if len(batch["ids"]) >= self.page_size:
+                    flush()
+            flush()
+            index.save()
+        except Exception:
+            self.vector_store.drop_version(name, version)
+            raise
+        # The sample query re-embeds one chunk, so this also catches a model mismatch
+        self.vector_store.commit_rebuild(name, version, store, info["count"], sample_text)
+        self.logger.log_system("info", f"Snapshot: restored {info['count']} chunks into {name}")
+
+    def _compare_docs(self, expected: List[dict]):
+        """Warn when the local docs/ differs from the one the snapshot was built from"""
+        local = {entry["path"]: entry["sha256"] for entry in self._docs_manifest()}
+        snapshot = {entry["path"]: entry["sha256"] for entry in expected}
+        missing = sorted(set(snapshot) - set(local))
+        changed = sorted(path for path in set(snapshot) & set(local) if snapshot[path] != local[path])
+        extra = sorted(set(local) - set(snapshot))
+        if missing or changed or extra:
+            self.logger.log_system("warning",
+                f"Snapshot docs differ from local {self.docs_dir}: {len(missing)} missing, "
+                f"{len(changed)} changed, {len(extra)} new; the next sync will update those sources")
+
+    def restore(self, archive_path: str) -> dict:
+        """
+        Restore all collections and ingestion state from a snapshot
+
+        Args:
+            archive_path: Snapshot archive written by export()
+
+        Returns:
+            The snapshot manifest
+        """
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as tmp:
+            work_dir = Path(tmp)
+            with tarfile.open(archive_path, "r") as tar:
+                manifest = json.load(tar.extractfile("snapshot.json"))
+                # Collection names become store and file paths, so only the known ones are accepted
+                unknown = sorted(set(manifest.get("collections", {})) - set(COLLECTIONS))
+                if unknown:
+                    raise ValueError(f"Snapshot contains unknown collections: {unknown[:5]}")
+                unsafe = [name for name in manifest["checksums"] if not _is_safe_member_name(name)]
+                if unsafe:
+                    raise ValueError(f"Snapshot contains unsafe member names: {unsafe[:5]}")
+                members = [tar.getmember(member) for member in manifest["checksums"]]
+                if any(not member.isfile() for member in members):
+                    raise ValueError("Snapshot contains unexpected non-file members")
+                if hasattr(tarfile, "data_filter"):
+                    # Also strips special permission bits; the names were already checked above
+                    tar.extractall(work_dir, members=members, filter="data")
+                else:
+                    tar.extractall(work_dir, members=members)
+
+            self._verify(work_dir, manifest)
+
+            for name, info in manifest["collections"].items():
+                self._restore_collection(work_dir, name, info)
+
+            if (work_dir / "ocr_cache").exists():
+                shutil.copytree(work_dir / "ocr_cache", self.ocr_cache_dir, dirs_exist_ok=True)
+            if (work_dir / "lab_results.json").exists():
+                self.lab_index_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(work_dir / "lab_results.json", self.lab_index_path)
+
+            self._compare_docs(json.loads((work_dir / "docs_manifest.json").read_text(encoding="utf-8")))
+
+        self.logger.log_system("info",
+            f"Snapshot {archive_path} restored in {time.perf_counter() - start:.1f}s")
+        return manifest
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.knowledge_base.index_snapshot export|import <archive>
+    parser = argparse.ArgumentParser(description="Export or import an index snapshot")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("archive", help="Path of the snapshot archive")
+    args = parser.parse_args()
+
+    snapshot = IndexSnapshot()
+    if args.command == "export":
+        result = snapshot.export(args.archive)
+    else:
+        result = snapshot.restore(args.archive)
+    print(json.dumps(result["collections"], indent=2))
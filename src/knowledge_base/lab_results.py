@@ -0,0 +1,386 @@
+import json
+import os
+import re
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from langchain_core.documents import Document
+from src.logging import Logger
+
+
+# Dates as they appear on lab reports; day-first for numeric formats
+_DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), lambda m: (int(m[1]), int(m[2]), int(m[3]))),
+    (re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b"), lambda m: (int(m[3]), int(m[2]), int(m[1]))),
+    (re.compile(r"\b(\d{1,2})[ -]([A-Za-z]{3})[A-Za-z]*[ ,-]+(\d{4})\b"),
+     lambda m: (int(m[3]), datetime.strptime(m[2].title(), "%b").month, int(m[1]))),
+]
+_DATE_KEYWORDS = re.compile(r"(date|collected|reported|sample|received)", re.IGNORECASE)
+
+# "Hemoglobin: 13.5 g/dL (13.0 - 17.0)", "HbA1c  6.5  %  4.0-5.6" or "WBC 7200 /cumm 4000-11000".
+# Numbers must end at a non-digit and the range must be set off by whitespace or a bracket,
+# so a line with a dropped space ("Glucose 10570-110") does not match at all instead of
+# being split into a wrong value and range.
+_NUMBER = r"\d+(?:\.\d+)?(?![\d.])"
+_RESULT_LINE = re.compile(
+    r"^\s*(?P<name>[A-Za-z][A-Za-z0-9 ,()/+'.-]{1,60}?)(?:\s*[:=]\s*|\s+)"
+    rf"(?P<value>[<>]?\s?{_NUMBER})"
+    r"(?:\s*(?P<unit>%|/?[A-Za-zµμ][A-Za-zµμ0-9/.^*]*))?"
+    rf"(?:(?:\s+|\s*[(\[]\s*)(?P<range>{_NUMBER}\s*(?:-|–|to)\s*{_NUMBER}|[<>]\s?{_NUMBER})\s*[)\]]?)?"
+    r"\s*$"
+)
+# A standalone number in the name means the line was not split where it should have been
+_NUMERIC_TOKEN = re.compile(r"[\d.,/-]*\d[\d.,/-]*")
+
+# Lines that look like "name value" but are report headers, not results
+_NON_ANALYTES = {
+    "age", "date", "page", "phone", "mobile", "tel", "patient", "name", "id", "uhid", "sex",
+    "gender", "sample", "lab", "ref", "reg", "dr", "doctor", "report", "time", "pin", "bill",
+    "collected", "reported", "received", "printed", "visit", "no", "order", "barcode",
+}
+
+# Header cells recognised in row-grouped XLSX/CSV documents ("Test | Result | Unit | ...")
+_COLUMN_ALIASES = {
+    "name": {"test", "test name", "analyte", "parameter", "investigation", "component", "name"},
+    "value": {"result", "value", "observed value", "observation", "results"},
+    "unit": {"unit", "units", "uom"},
+    "range": {"reference range", "reference", "ref range", "range", "normal range", "biological reference interval"},
+    "date": {"date", "collection date", "sample date", "report date", "collected"},
+}
+
+# Common alternative names, mapped to the analyte key they should resolve to
+_ANALYTE_ALIASES = {
+    "a1c": "hba1c",
+    "glycatedhemoglobin": "hba1c",
+    "glycosylatedhemoglobin": "hba1c",
+    "haemoglobin": "hemoglobin",
+    "hb": "hemoglobin",
+    "bloodsugar": "glucose",
+    "sugar": "glucose",
+    "vitd": "vitamind",
+    "b12": "vitaminb12",
+}
+
+# Words that may surround an analyte in a simple lookup question
+_QUERY_FILLER = {
+    "what", "whats", "was", "is", "were", "are", "my", "the", "me", "show", "tell", "give", "get",
+    "value", "values", "level", "levels", "result", "results", "reading", "readings", "of", "for",
+    "please", "a", "an", "in", "test", "latest", "last", "recent", "most", "current", "lab",
+    "history", "all", "trend", "previous", "past", "over", "time", "did", "do", "i", "have", "s",
+}
+_HISTORY_WORDS = {"history", "all", "trend", "previous", "past", "values", "readings", "results"}
+
+
+def analyte_key(name: str) -> str:
+    """Normalize an analyte name for lookups ("Hb A1c" -> "hba1c")"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def canonical_analyte(name: str) -> str:
+    """Analyte key with aliases resolved, so every spelling shares one key ("Hb" -> "hemoglobin")"""
+    key = analyte_key(name)
+    return _ANALYTE_ALIASES.get(key, key)
+
+
+def parse_date(text: str) -> Optional[str]:
+    """Return the first date in text as an ISO string, or None"""
+    for pattern, to_parts in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            try:
+                year, month, day = to_parts(match)
+                return datetime(year, month, day).date().isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+class LabResultExtractor:
+    """Parses analyte/value/unit/reference-range/date rows out of lab report text"""
+
+    def _document_date(self, text: str) -> Optional[str]:
+        """Prefer a date on a line mentioning date/collected/reported, else the first date"""
+        for line in text.splitlines():
+            if _DATE_KEYWORDS.search(line):
+                date = parse_date(line)
+                if date:
+                    return date
+        return parse_date(text)
+
+    def _parse_line(self, line: str) -> Optional[dict]:
+        match = _RESULT_LINE.match(line)
+        if not match:
+            return None
+        name = match["name"].strip(" .,-:")
+        first_word = name.split()[0].lower().rstrip(".:") if name else ""
+        if len(re.sub(r"[^A-Za-z]", "", name)) < 2 or first_word in _NON_ANALYTES:
+            return None
+        if any(_NUMERIC_TOKEN.fullmatch(token) for token in name.split()):
+            # Results are answered without the LLM, so drop an ambiguous line rather than guess
+            return None
+        return {
+            "name": name,
+            "value_text": match["value"].replace(" ", ""),
+            "unit": match["unit"] or "",
+            "reference_range": (match["range"] or "").replace(" ", ""),
+        }
+
+    def _header_columns(self, cells: List[str]) -> Optional[Dict[str, int]]:
+        """Map a table header row to column positions, if it looks like a results table"""
+        columns = {}
+        for position, cell in enumerate(cells):
+            for field, aliases in _COLUMN_ALIASES.items():
+                if cell.strip().lower() in aliases and field not in columns:
+                    columns[field] = position
+        return columns if "name" in columns and "value" in columns else None
+
+    def _parse_table_row(self, cells: List[str], columns: Dict[str, int]) -> Optional[dict]:
+        def cell(field: str) -> str:
+            position = columns.get(field)
+            return cells[position].strip() if position is not None and position < len(cells) else ""
+
+        name, value_text = cell("name"), cell("value").replace(" ", "")
+        if not name or not re.fullmatch(r"[<>]?\d+(?:\.\d+)?", value_text):
+            return None
+        return {
+            "name": name,
+            "value_text": value_text,
+            "unit": cell("unit"),
+            "reference_range": cell("range").replace(" ", ""),
+            "date": parse_date(cell("date")) if cell("date") else None,
+        }
+
+    def extract(self, documents: List[Document]) -> List[dict]:
+        """
+        Extract lab results from loaded documents
+
+        Args:
+            documents: Lab report documents as returned by Ingestion
+
+        Returns:
+            List of result rows (name, value_text, unit, reference_range, date, source)
+        """
+        # A date printed on any page of a report applies to the whole report
+        source_dates = {}
+        for doc in documents:
+            source = doc.metadata.get("source", "Unknown")
+            if source not in source_dates:
+                date = self._document_date(doc.page_content)
+                if date:
+                    source_dates[source] = date
+
+        rows = []
+        for doc in documents:
+            source = doc.metadata.get("source", "Unknown")
+            date = self._document_date(doc.page_content) or source_dates.get(source)
+            columns = None
+            for line in doc.page_content.splitlines():
+                if "|" in line:
+                    cells = line.split("|")
+                    header = self._header_columns(cells)
+                    if header:
+                        columns = header
+                        continue
+                    row = self._parse_table_row(cells, columns) if columns else None
+                else:
+                    row = self._parse_line(line)
+
+                if row:
+                    row["date"] = row.get("date") or date or ""
+                    row["source"] = source
+                    rows.append(row)
+        return rows
+
+
+class LabResultIndex:
+    """
+    Compact columnar table of extracted lab results, indexed by analyte and date.
+
+    Answers simple lookups such as "what was my latest HbA1c" directly from the
+    table, with the source report as citation, without vector search or the LLM.
+    The table is rebuilt whenever lab reports are ingested and persisted as JSON,
+    so serving processes pick up a new version on their next lookup.
+    """
+
+    _COLUMNS = ("analyte", "name", "value_text", "unit", "reference_range", "date", "source")
+
+    def __init__(self, index_path: str = "lab_index/lab_results.json"):
+        """
+        Args:
+            index_path: Where the table is persisted (default: "lab_index/lab_results.json")
+        """
+        self.logger = Logger()
+        self.index_path = Path(index_path)
+        self.extractor = LabResultExtractor()
+        self._loaded_mtime = None
+        self._set_rows([])
+
+    def _set_rows(self, rows: List[dict]):
+        """Store rows column by column and rebuild the analyte -> rows-by-date index"""
+        self.columns: Dict[str, List[str]] = {
+            column: [row.get(column, "") for row in rows] for column in self._COLUMNS
+        }
+        self.values = array("d", (float(row["value_text"].lstrip("<>")) for row in rows))
+
+        self.by_analyte: Dict[str, List[int]] = {}
+        for row_id, key in enumerate(self.columns["analyte"]):
+            # Tables saved before aliases were resolved at build time still store raw keys
+            self.by_analyte.setdefault(_ANALYTE_ALIASES.get(key, key), []).append(row_id)
+        for row_ids in self.by_analyte.values():
+            # Undated rows sort first, so a dated result always wins as "latest"
+            row_ids.sort(key=lambda row_id: self.columns["date"][row_id])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def build(self, documents: List[Document]) -> int:
+        """
+        Rebuild the table from lab report documents and persist it
+
+        Args:
+            documents: Lab report documents as returned by Ingestion
+
+        Returns:
+            Number of results extracted
+        """
+        rows = self.extractor.extract(documents)
+        for row in rows:
+            row["analyte"] = canonical_analyte(row["name"])
+        self._set_rows(rows)
+        self.save()
+        self.logger.log_system("info",
+            f"Indexed {len(rows)} lab results for {len(self.by_analyte)} analytes from {len(documents)} documents")
+        return len(rows)
+
+    def save(self):
+        """Write the table to index_path atomically"""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "columns": self.columns}, f)
+        os.replace(tmp_path, self.index_path)
+        self._loaded_mtime = self.index_path.stat().st_mtime
+
+    def refresh(self) -> bool:
+        """
+        Reload the table if the file on disk changed since it was last loaded
+
+        Returns:
+            True if a table is available
+        """
+        try:
+            mtime = self.index_path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime != self._loaded_mtime:
+            with open(self.index_path, encoding="utf-8") as f:
+                columns = json.load(f)["columns"]
+            count = len(columns["analyte"])
+            self._set_rows([{column: columns[column][i] for column in self._COLUMNS} for i in range(count)])
+            self._loaded_mtime = mtime
+        return True
+
+    def lookup(self, analyte: str) -> List[dict]:
+        """
+        Get all results for an analyte, oldest first
+
+        Args:
+            analyte: Analyte name in any spelling ("HbA1c", "Hb A1c", "a1c")
+
+        Returns:
+            List of result rows
+        """
+        key = canonical_analyte(analyte)
+        return [
+            {**{column: self.columns[column][row_id] for column in self._COLUMNS}, "value": self.values[row_id]}
+            for row_id in self.by_analyte.get(key, [])
+        ]
+
+    def _match_query(self, query: str):
+        """
+        Find the analyte a query asks about, if the query is a simple lookup
+
+        Returns:
+            (analyte key, wants history) or None when the query needs the full RAG path
+        """
+        words = re.findall(r"[a-z0-9]+", query.lower())
+        best = None
+        # Analyte names can span several words ("vitamin b12"); prefer the longest match
+        for size in range(min(4, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                key = canonical_analyte("".join(words[start:start + size]))
+                if key in self.by_analyte:
+                    best = (key, start, size)
+                    break
+            if best:
+                break
+        if not best:
+            return None
+
+        key, start, size = best
+        leftover = [word for word in words[:start] + words[start + size:] if word not in _QUERY_FILLER]
+        if leftover:
+            # Anything else in the question (why, compare, medication, ...) needs the LLM
+            return None
+        return key, any(word in _HISTORY_WORDS for word in words)
+
+    def _format_result(self, row_id: int) -> str:
+        text = f"{self.columns['value_text'][row_id]}"
+        if self.columns["unit"][row_id]:
+            text += f" {self.columns['unit'][row_id]}"
+        if self.columns["reference_range"][row_id]:
+            text += f" (reference range {self.columns['reference_range'][row_id]})"
+        if self.columns["date"][row_id]:
+            text += f" on {self.columns['date'][row_id]}"
+        return text
+
+    def answer(self, query: str, number_source: Optional[Callable[[str], int]] = None) -> Optional[Dict[str, any]]:
+        """
+        Answer a simple analyte lookup directly from the table
+
+        Args:
+            query: User's question
+            number_source: Returns the document number to cite a source file as, e.g. a
+                conversation's session-wide numbering (default: number sources 1, 2, ...)
+
+        Returns:
+            None if the query is not a simple lookup, otherwise a dictionary shaped like
+            MedicalLLM.get_response: response, source_details, total_sources
+        """
+        if not self.refresh() or not self.by_analyte:
+            return None
+        match = self._match_query(query)
+        if not match:
+            return None
+
+        key, wants_history = match
+        row_ids = self.by_analyte[key]
+        if not wants_history:
+            row_ids = row_ids[-1:]
+
+        # Number sources in order of first appearance, like the LLM path does
+        source_numbers: Dict[str, int] = {}
+        for row_id in row_ids:
+            source = self.columns["source"][row_id]
+            if source not in source_numbers:
+                source_numbers[source] = number_source(source) if number_source else len(source_numbers) + 1
+
+        name = self.columns["name"][row_ids[-1]]
+        if wants_history:
+            lines = [f"Your {name} results:"]
+            lines += [
+                f"- {self._format_result(row_id)} [Doc {source_numbers[self.columns['source'][row_id]]}]"
+                for row_id in row_ids
+            ]
+            response = "\n".join(lines)
+        else:
+            row_id = row_ids[0]
+            response = (f"Your latest {name} was {self._format_result(row_id)} "
+                        f"[Doc {source_numbers[self.columns['source'][row_id]]}].")
+
+        self.logger.log_system("info", f"Answered query from lab result index ({key}, {len(row_ids)} results)")
+        return {
+            "response": response,
+            "source_details": {f"Document {number}": source for source, number in source_numbers.items()},
+            "total_sources": len(source_numbers)
+        }
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from src.logging import Logger
+
+
+class OCRProcessor:
+    """
+    Runs OCR on images with a persistent result cache and a preprocessing stage.
+
+    - Results are cached on disk, keyed by the SHA-256 of the image bytes plus the
+      OCR settings, so an unchanged image is never OCRed twice.
+    - Before OCR the image is downscaled to target_dpi, converted to grayscale and
+      binarized (Otsu threshold), which is both faster and more accurate than
+      feeding tesseract a full-resolution color photo.
+    - OCR runs on a long-lived thread pool. When `tesserocr` is installed each
+      worker keeps its own in-process tesseract instance; otherwise it falls back
+      to `pytesseract`, which still runs in parallel but spawns one tesseract
+      process per image.
+    - Multi-page images (e.g. TIFF) and text-less pages of scanned PDFs are OCRed
+      page by page, in parallel, with one cache entry per page.
+
+    The worker pool is shared by all OCRProcessor instances in the process.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+    _thread_local = threading.local()
+    # pdfium is not thread-safe, so page rendering is serialized (OCR itself is not)
+    _pdfium_lock = threading.Lock()
+
+    def __init__(self, cache_dir: str = "ocr_cache", lang: str = "eng", psm: int = 3,
+                 target_dpi: int = 300, binarize: bool = True, max_workers: Optional[int] = None):
+        """
+        Args:
+            cache_dir: Directory for cached OCR results (default: "ocr_cache")
+            lang: Tesseract language(s), e.g. "eng" or "eng+deu" (default: "eng")
+            psm: Tesseract page segmentation mode (default: 3, fully automatic)
+            target_dpi: Images with a higher DPI are downscaled to this (default: 300)
+            binarize: Whether to binarize images before OCR (default: True)
+            max_workers: Size of the shared OCR pool (default: number of CPUs)
+        """
+        self.logger = Logger()
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.lang = lang
+        self.psm = psm
+        self.target_dpi = target_dpi
+        self.binarize = binarize
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        # Anything that changes the OCR output must be part of the cache key
+        self.settings = {
+            "lang": lang,
+            "psm": psm,
+            "target_dpi": target_dpi,
+            "binarize": binarize,
+        }
+        self._settings_key = json.dumps(self.settings, sort_keys=True)
+
+        try:
+            import tesserocr  # noqa: F401
+            self.engine = "tesserocr"
+        except ImportError:
+            self.engine = "pytesseract"
+
+    @classmethod
+    def _get_executor(cls, max_workers: int) -> ThreadPoolExecutor:
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr-worker")
+            return cls._executor
+
+    def _cache_path(self, content_hash: str) -> Path:
+        """Cache file for an image hash under the current settings"""
+        key = hashlib.sha256(f"{content_hash}:{self._settings_key}".encode("utf-8")).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.txt"
+
+    def _read_cache(self, content_hash: str) -> Optional[str]:
+        cache_path = self._cache_path(content_hash)
+        if cache_path.exists():
+            return cache_path.read_text(encoding="utf-8")
+        return None
+
+    def _write_cache(self, content_hash: str, text: str):
+        cache_path = self._cache_path(content_hash)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated entry
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+
+    @staticmethod
+    def _otsu_threshold(gray) -> int:
+        """Compute the Otsu binarization threshold from a grayscale image histogram"""
+        histogram = gray.histogram()
+        total = sum(histogram)
+        sum_total = sum(i * count for i, count in enumerate(histogram))
+
+        sum_background, weight_background = 0.0, 0
+        best_threshold, best_variance = 0, 0.0
+        for threshold, count in enumerate(histogram):
+            weight_background += count
+            if weight_background == 0:
+                continue
+            weight_foreground = total - weight_background
+            if weight_foreground == 0:
+                break
+            sum_background += threshold * count
+            mean_background = sum_background / weight_background
+            mean_foreground = (sum_total - sum_background) / weight_foreground
+            variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+            if variance > best_variance:
+                best_threshold, best_variance = threshold, variance
+        return best_threshold
+
+    def preprocess(self, image):
+        """
+        Prepare an image for OCR: downscale to target_dpi, grayscale, binarize
+
+        Args:
+            image: PIL image
+
+        Returns:
+            Preprocessed PIL image
+        """
+        from PIL import Image
+
+        dpi = image.info.get("dpi")
+        if dpi and dpi[0] and dpi[0] > self.target_dpi:
+            scale = self.target_dpi / float(dpi[0])
+            new_size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+            image = image.resize(new_size, Image.LANCZOS)
+
+        gray = image.convert("L")
+        if not self.binarize:
+            return gray
+
+        threshold = self._otsu_threshold(gray)
+        return gray.point(lambda value: 255 if value > threshold else 0, mode="1")
+
+    def _recognize(self, image) -> str:
+        """Run tesseract on a preprocessed image in the current worker thread"""
+        if self.engine == "tesserocr":
+            import tesserocr
+
+            # One tesseract instance per worker thread and settings, reused across images
+            apis = getattr(self._thread_local, "apis", None)
+            if apis is None:
+                apis = self._thread_local.apis = {}
+            api = apis.get(self._settings_key)
+            if api is None:
+                api = apis[self._settings_key] = tesserocr.PyTessBaseAPI(lang=self.lang, psm=self.psm)
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+        import pytesseract
+        return pytesseract.image_to_string(image, lang=self.lang, config=f"--psm {self.psm}")
+
+    def ocr_image(self, image, content_hash: str) -> str:
+        """
+        OCR an already opened image, using the cache
+
+        Args:
+            image: PIL image
+            content_hash: Stable hash identifying the image content
+
+        Returns:
+            Extracted text
+        """
+        cached = self._read_cache(content_hash)
+        if cached is not None:
+            return cached
+
+        text = self._recognize(self.preprocess(image))
+        self._write_cache(content_hash, text)
+        return text
+
+    @staticmethod
+    def _file_hash(file_path: str) -> str:
+        """SHA-256 of a file, read in blocks so the file is never held in memory"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _page_hash(content_hash: str, page: int) -> str:
+        """Cache hash for one page of a multi-page file"""
+        return f"{content_hash}:page={page}"
+
+    def _ocr_image_frame(self, file_path: str, frame: int, content_hash: str) -> str:
+        """Read and decode one frame of an image file and OCR it (runs on the pool)"""
+        from PIL import Image
+
+        with Image.open(file_path) as image:
+            image.seek(frame)
+            return self.ocr_image(image, content_hash)
+
+    def _render_pdf_page(self, file_path: str, page: int):
+        """
+        Rasterize a PDF page at target_dpi. Uses pypdfium2 when installed, otherwise
+        falls back to the largest image embedded in the page, which for scanned PDFs
+        is the scan itself.
+        """
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            pdfium = None
+
+        if pdfium is not None:
+            with self._pdfium_lock:
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    bitmap = pdf[page].render(scale=self.target_dpi / 72.0)
+                    return bitmap.to_pil()
+                finally:
+                    pdf.close()
+
+        from pypdf import PdfReader
+
+        images = PdfReader(file_path).pages[page].images
+        if not images:
+            return None
+        largest = max(images, key=lambda embedded: embedded.image.width * embedded.image.height)
+        return largest.image
+
+    def _ocr_pdf_page(self, file_path: str, page: int, content_hash: str) -> str:
+        """Rasterize one PDF page and OCR it (runs on the pool)"""
+        image = self._render_pdf_page(file_path, page)
+        if image is None:
+            self._write_cache(content_hash, "")
+            return ""
+        return self.ocr_image(image, content_hash)
+
+    def _submit_page(self, content_hash: str, task, *args) -> Future:
+        """Return a finished future on a cache hit, otherwise queue the page on the pool"""
+        cached = self._read_cache(content_hash)
+        if cached is not None:
+            future: Future = Future()
+            future.set_result(cached)
+            return future
+        return self._get_executor(self.max_workers).submit(task, *args, content_hash)
+
+    def submit_image_pages(self, file_path: str) -> List[Future]:
+        """
+        Queue every page of an image file for OCR. Only the file's hash and page count
+        are read here; each page is read from disk by the worker that OCRs it, so queued
+        files are not held in memory.
+
+        Args:
+            file_path: Path to the image
+
+        Returns:
+            One future per page, in page order, each resolving to the page text
+        """
+        from PIL import Image
+
+        content_hash = self._file_hash(file_path)
+        with Image.open(file_path) as image:
+            n_frames = getattr(image, "n_frames", 1)
+
+        if n_frames == 1:
+            return [self._submit_page(content_hash, self._ocr_image_frame, file_path, 0)]
+
+        self.logger.log_system("info", f"Queueing {n_frames} pages of {file_path} for OCR")
+        return [
+            self._submit_page(self._page_hash(content_hash, frame), self._ocr_image_frame, file_path, frame)
+            for frame in range(n_frames)
+        ]
+
+    def submit_pdf_pages(self, file_path: str, pages: List[int]) -> Dict[int, Future]:
+        """
+        Queue selected pages of a PDF (typically the ones without a text layer) for OCR
+
+        Args:
+            file_path: Path to the PDF
+            pages: Zero-based page numbers to OCR
+
+        Returns:
+            Mapping of page number to a future resolving to the page text
+        """
+        content_hash = self._file_hash(file_path)
+        self.logger.log_system("info", f"Queueing {len(pages)} scanned pages of {file_path} for OCR")
+        return {
+            page: self._submit_page(self._page_hash(content_hash, page), self._ocr_pdf_page, file_path, page)
+            for page in pages
+        }
@@ -0,0 +1,333 @@
+import atexit
+import bisect
+import hashlib
+import heapq
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from src.logging import Logger
+
+
+# Shard worker process state. Each shard has a single-process pool whose process
+# opens the shard's Chroma collection once and then serves reads and writes for it.
+# Only embeddings cross the process boundary, so workers never load the model.
+
+_client = None
+_collection = None
+_collection_name = None
+
+
+def _open_shard(persist_directory: str, collection_name: str):
+    global _client, _collection, _collection_name
+    import chromadb
+
+    _client = chromadb.PersistentClient(path=persist_directory)
+    _collection_name = collection_name
+    _collection = _client.get_or_create_collection(collection_name)
+
+
+def _shard_query(embedding: List[float], k: int, where: Optional[dict]) -> List[tuple]:
+    if _collection.count() == 0:
+        return []
+    results = _collection.query(
+        query_embeddings=[embedding],
+        n_results=k,
+        where=where,
+        include=["documents", "metadatas", "distances"]
+    )
+    return list(zip(results["distances"][0], results["documents"][0], results["metadatas"][0]))
+
+
+def _shard_upsert(ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[dict]):
+    _collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas or None)
+
+
+def _shard_delete(ids: List[str]):
+    _collection.delete(ids=ids)
+
+
+def _shard_get(include: List[str], where: Optional[dict], limit: Optional[int], offset: Optional[int],
+               ids: Optional[List[str]] = None) -> dict:
+    results = _collection.get(ids=ids, include=include, where=where, limit=limit, offset=offset)
+    if results.get("embeddings") is not None:
+        results["embeddings"] = [list(map(float, embedding)) for embedding in results["embeddings"]]
+    return {key: results.get(key) for key in ["ids"] + include}
+
+
+def _shard_count() -> int:
+    return _collection.count()
+
+
+def _shard_reset():
+    global _collection
+    try:
+        _client.delete_collection(_collection_name)
+    except Exception:
+        pass
+    _collection = _client.get_or_create_collection(_collection_name)
+
+
+class ConsistentHashRing:
+    """Maps partition keys to shards so that adding a shard only moves ~1/N of the keys"""
+
+    def __init__(self, num_shards: int, virtual_nodes: int = 64):
+        self.num_shards = num_shards
+        points = []
+        for shard in range(num_shards):
+            for replica in range(virtual_nodes):
+                points.append((self._hash(f"shard-{shard}-{replica}"), shard))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def shard_for(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+
+class ShardedVectorStore:
+    """
+    A vector collection partitioned into shards, each served by its own process.
+
+    Chunks are assigned to shards by hashing a metadata field (the source path by
+    default, or e.g. a patient/tenant id) on a consistent hash ring. Queries are
+    embedded once in this process, sent to every shard in parallel, and the
+    per-shard top-k lists are merged with a heap.
+
+    It implements the parts of the langchain Chroma API that VectorStore uses
+    (get, delete, add_documents, delete_collection, similarity_search), so it can be
+    used anywhere a Chroma store is.
+
+    The shard count is recorded in shards.json; opening a collection with a
+    different count moves the affected chunks (with their stored embeddings, no
+    re-embedding) before the store is used.
+    """
+
+    _stores: Dict[tuple, "ShardedVectorStore"] = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, collection_name: str, embedding_function: Embeddings, persist_directory: str,
+                 num_shards: int = 2, shard_key: str = "source"):
+        """
+        Args:
+            collection_name: Name of the collection
+            embedding_function: Embedding model used for documents and queries
+            persist_directory: Directory holding one sub-directory per shard
+            num_shards: Number of shards (default: 2)
+            shard_key: Metadata field used to assign chunks to shards (default: "source")
+        """
+        self.logger = Logger()
+        self._collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.persist_directory = Path(persist_directory)
+        self.persist_directory.mkdir(parents=True, exist_ok=True)
+        self.num_shards = num_shards
+        self.shard_key = shard_key
+        self.ring = ConsistentHashRing(num_shards)
+        self._executors: Dict[int, ProcessPoolExecutor] = {}
+        self._executors_lock = threading.Lock()
+
+        previous = self._read_manifest()
+        if previous and (previous["num_shards"] != num_shards or previous["shard_key"] != shard_key):
+            self._rebalance(previous["num_shards"])
+        self._write_manifest()
+
+        self.logger.log_system("info",
+            f"Opened sharded collection {collection_name} with {num_shards} shards (key={shard_key})")
+
+    @classmethod
+    def shared(cls, collection_name: str, embedding_function: Embeddings, persist_directory: str,
+               num_shards: int = 2, shard_key: str = "source") -> "ShardedVectorStore":
+        """Get the process-wide store for a collection, starting its shard workers on first use"""
+        key = (str(persist_directory), collection_name, num_shards, shard_key)
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                store = cls(collection_name, embedding_function, persist_directory, num_shards, shard_key)
+                cls._stores[key] = store
+            return store
+
+    @classmethod
+    def release(cls, persist_directory: str):
+        """Stop and forget the stores of a directory (e.g. before it is deleted)"""
+        with cls._stores_lock:
+            for key in [key for key in cls._stores if key[0] == str(persist_directory)]:
+                cls._stores.pop(key).close()
+
+    def _shard_directory(self, shard: int) -> str:
+        return str(self.persist_directory / f"shard_{shard}")
+
+    def _executor(self, shard: int) -> ProcessPoolExecutor:
+        with self._executors_lock:
+            executor = self._executors.get(shard)
+            if executor is None:
+                # spawn, not fork: the parent runs embedding/OCR threads that must not be forked
+                executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_open_shard,
+                    initargs=(self._shard_directory(shard), self._collection_name)
+                )
+                self._executors[shard] = executor
+            return executor
+
+    def _scatter(self, func, *args, shards=None) -> Dict[int, object]:
+        """Run func on the given shards (default: all) in parallel and gather the results"""
+        shards = range(self.num_shards) if shards is None else shards
+        futures = {shard: self._executor(shard).submit(func, *args) for shard in shards}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def close(self):
+        """Stop all shard worker processes"""
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        self._executors.clear()
+
+    def _manifest_path(self) -> Path:
+        return self.persist_directory / "shards.json"
+
+    def _read_manifest(self) -> Optional[dict]:
+        if not self._manifest_path().exists():
+            return None
+        return json.loads(self._manifest_path().read_text(encoding="utf-8"))
+
+    def _write_manifest(self):
+        self._manifest_path().write_text(
+            json.dumps({"num_shards": self.num_shards, "shard_key": self.shard_key}), encoding="utf-8")
+
+    def _shard_for(self, metadata: Optional[dict]) -> int:
+        return self.ring.shard_for(str((metadata or {}).get(self.shard_key, "")))
+
+    def _rebalance(self, previous_num_shards: int, page_size: int = 1000):
+        """Move chunks whose shard changed under the current ring; embeddings are copied, not recomputed"""
+        self.logger.log_system("info",
+            f"Rebalancing {self._collection_name} from {previous_num_shards} to {self.num_shards} shards")
+        moved = 0
+        for shard in range(previous_num_shards):
+            to_delete = []
+            offset = 0
+            while True:
+                page = self._executor(shard).submit(
+                    _shard_get, ["embeddings", "documents", "metadatas"], None, page_size, offset).result()
+                if not page["ids"]:
+                    break
+                offset += len(page["ids"])
+
+                moves: Dict[int, dict] = {}
+                for i, chunk_id in enumerate(page["ids"]):
+                    target = self._shard_for(page["metadatas"][i])
+                    if target == shard:
+                        continue
+                    batch = moves.setdefault(target, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+                    for field, value in (("ids", chunk_id), ("embeddings", page["embeddings"][i]),
+                                         ("documents", page["documents"][i]), ("metadatas", page["metadatas"][i])):
+                        batch[field].append(value)
+                    to_delete.append(chunk_id)
+
+                for target, batch in moves.items():
+                    self._executor(target).submit(
+                        _shard_upsert, batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]
+                    ).result()
+
+            # Delete only after the whole shard was read, so paging offsets stay valid
+            if to_delete:
+                self._executor(shard).submit(_shard_delete, to_delete).result()
+                moved += len(to_delete)
+
+        # Shards beyond the new count are empty now; stop their workers
+        for shard in range(self.num_shards, previous_num_shards):
+            executor = self._executors.pop(shard, None)
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+        self.logger.log_system("info", f"Rebalanced {self._collection_name}: moved {moved} chunks")
+
+    def add_documents(self, documents: List[Document], ids: List[str]) -> List[str]:
+        """Embed documents once and write each to its shard"""
+        if not documents:
+            return []
+        embeddings = self.embedding_function.embed_documents([doc.page_content for doc in documents])
+        self.add_embeddings(list(ids), embeddings, [doc.page_content for doc in documents],
+                            [doc.metadata for doc in documents])
+        return list(ids)
+
+    def add_embeddings(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+                       metadatas: List[dict]):
+        """Write chunks with precomputed embeddings (e.g. from a snapshot) to their shards"""
+        batches: Dict[int, dict] = {}
+        for row in zip(ids, embeddings, documents, metadatas):
+            batch = batches.setdefault(self._shard_for(row[3]),
+                                       {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            for field, value in zip(("ids", "embeddings", "documents", "metadatas"), row):
+                batch[field].append(value)
+
+        futures = [
+            self._executor(shard).submit(
+                _shard_upsert, batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+            for shard, batch in batches.items()
+        ]
+        for future in futures:
+            future.result()
+
+    def iter_pages(self, include: List[str], page_size: int = 1000):
+        """Yield get()-style result pages, shard by shard, without loading a whole shard at once"""
+        for shard in range(self.num_shards):
+            offset = 0
+            while True:
+                page = self._executor(shard).submit(_shard_get, include, None, page_size, offset).result()
+                if not page["ids"]:
+                    break
+                offset += len(page["ids"])
+                yield page
+
+    def delete(self, ids: List[str]):
+        """Delete chunks by id (ids are not routed, so every shard is asked)"""
+        if ids:
+            self._scatter(_shard_delete, list(ids))
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None,
+            where: Optional[dict] = None, limit: Optional[int] = None, offset: Optional[int] = None) -> dict:
+        """Read chunks from all shards; limit/offset apply per shard"""
+        include = include or ["documents", "metadatas"]
+        merged = {key: [] for key in ["ids"] + include}
+        for shard, results in sorted(self._scatter(_shard_get, include, where, limit, offset, ids).items()):
+            for key in merged:
+                merged[key].extend(results.get(key) or [])
+        return merged
+
+    def count(self) -> int:
+        return sum(self._scatter(_shard_count).values())
+
+    def delete_collection(self):
+        """Empty every shard"""
+        self._scatter(_shard_reset)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None) -> List[Document]:
+        """Scatter the query to all shards and merge their top-k by distance"""
+        per_shard = self._scatter(_shard_query, embedding, k, filter)
+        best = heapq.nsmallest(
+            k,
+            (hit for hits in per_shard.values() for hit in hits),
+            key=lambda hit: hit[0]
+        )
+        return [Document(page_content=document, metadata=metadata or {}) for _, document, metadata in best]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Document]:
+        """Embed the query once, then search all shards in parallel"""
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+
+@atexit.register
+def _close_all_stores():
+    for store in ShardedVectorStore._stores.values():
+        store.close()
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from src.logging import Logger
+from src.initialize_embeddings.load_embeddings import DEFAULT_MODEL_NAME
+from .source_index import iter_pages
+
+
+SERVING_COLLECTIONS = ["lab_reports", "prescriptions", "combined"]
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive lock on path across processes, held while the block runs"""
+    with open(path, "a+b") as lock_file:
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            import msvcrt
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class IndexPublisher:
+    """
+    Publishes the active collections as an immutable, memory-mappable generation.
+
+    A generation is a directory serving/gen-<N>/ holding, per collection, the
+    embeddings as a row-major float32 matrix, their squared norms, the chunks as
+    JSON lines and the byte offset of every line. It is written under a
+    temporary name and renamed into place, then index_version.json is replaced
+    atomically to point at it. Serving workers (SharedIndexReader) watch that
+    file and switch to the new generation on their next query.
+    """
+
+    def __init__(self, vector_store, serving_dir: str = "serving", keep_generations: int = 2,
+                 page_size: int = 1000):
+        """
+        Args:
+            vector_store: VectorStore whose active collection versions are published
+            serving_dir: Directory holding the generations and index_version.json (default: "serving")
+            keep_generations: Number of generations kept on disk (default: 2)
+            page_size: Number of chunks read from the store per page (default: 1000)
+        """
+        self.logger = Logger()
+        self.vector_store = vector_store
+        self.serving_dir = Path(serving_dir)
+        self.keep_generations = keep_generations
+        self.page_size = page_size
+
+    def _version_path(self) -> Path:
+        return self.serving_dir / "index_version.json"
+
+    def _current(self) -> Optional[dict]:
+        try:
+            with open(self._version_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _fingerprint(self, store) -> str:
+        """Identify a collection's contents by its chunk ids, from the source index"""
+        index = self.vector_store.source_index(store._collection_name).ensure(store)
+        return hashlib.sha1("\n".join(sorted(index.all_ids())).encode("utf-8")).hexdigest()
+
+    def _write_collection(self, store, directory: Path) -> dict:
+        directory.mkdir(parents=True)
+        count, dimensions = 0, 0
+        offset = 0
+        offsets = [0]
+        with open(directory / "embeddings.f32", "wb") as embeddings_file, \
+                open(directory / "norms.f32", "wb") as norms_file, \
+                open(directory / "chunks.jsonl", "wb") as chunks_file:
+            for page in iter_pages(store, ["embeddings", "documents", "metadatas"], self.page_size):
+                vectors = np.asarray(page["embeddings"], dtype="<f4")
+                embeddings_file.write(vectors.tobytes())
+                norms_file.write(np.einsum("ij,ij->i", vectors, vectors).astype("<f4").tobytes())
+                for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    line = (json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n").encode("utf-8")
+                    chunks_file.write(line)
+                    offset += len(line)
+                    offsets.append(offset)
+                count += len(vectors)
+                dimensions = dimensions or vectors.shape[1]
+        np.asarray(offsets, dtype="<i8").tofile(directory / "offsets.i64")
+        return {"count": count, "dimensions": dimensions}
+
+    def publish(self, force: bool = False) -> Optional[int]:
+        """
+        Write a new generation if any collection changed since the current one
+
+        Args:
+            force: Publish even if nothing changed
+
+        Returns:
+            The new generation number, or None if nothing was published
+        """
+        # Publishers in several processes would otherwise pick the same gen-N and
+        # overwrite each other's gen-N.tmp
+        self.serving_dir.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self.serving_dir / "publish.lock"):
+            return self._publish(force)
+
+    def _publish(self, force: bool) -> Optional[int]:
+        current = self._current()
+        stores = {name: self.vector_store.get_store(name) for name in SERVING_COLLECTIONS}
+        fingerprints = {name: self._fingerprint(store) for name, store in stores.items()}
+        if not force and current and current.get("fingerprints") == fingerprints:
+            self.logger.log_system("info", f"Serving generation {current['generation']} is up to date")
+            return None
+
+        # A publish that crashed before switching the pointer leaves its gen-N behind; skip past it
+        generation = max([current["generation"] if current else 0] + self._generations_on_disk()) + 1
+        self.serving_dir.mkdir(parents=True, exist_ok=True)
+        final_dir = self.serving_dir / f"gen-{generation}"
+        tmp_dir = self.serving_dir / f"gen-{generation}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        start = time.perf_counter()
+        collections = {name: self._write_collection(store, tmp_dir / name) for name, store in stores.items()}
+        manifest = {
+            "generation": generation,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "embedding_model": DEFAULT_MODEL_NAME,
+            "collections": collections,
+            "fingerprints": fingerprints,
+        }
+        (tmp_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp_dir, final_dir)
+
+        # Switch readers over, then drop old generations (open mappings stay valid after unlink)
+        tmp_path = self._version_path().with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"generation": generation, "fingerprints": fingerprints}), encoding="utf-8")
+        os.replace(tmp_path, self._version_path())
+        self._collect_garbage(generation)
+
+        counts = ", ".join(f"{name}: {info['count']}" for name, info in collections.items())
+        self.logger.log_system("info",
+            f"Published serving generation {generation} ({counts}) in {time.perf_counter() - start:.1f}s")
+        return generation
+
+    def _generations_on_disk(self) -> List[int]:
+        numbers = (path.name[len("gen-"):] for path in self.serving_dir.glob("gen-*"))
+        return [int(number) for number in numbers if number.isdigit()]
+
+    def _collect_garbage(self, generation: int):
+        for number in self._generations_on_disk():
+            if number <= generation - self.keep_generations:
+                shutil.rmtree(self.serving_dir / f"gen-{number}", ignore_errors=True)
+
+
+class _MappedCollection:
+    """One collection of a generation, memory-mapped read-only"""
+
+    def __init__(self, directory: Path, count: int, dimensions: int):
+        self.count = count
+        if count == 0:
+            return
+        # Pages come from the OS page cache, so every worker on the node shares one copy
+        self.embeddings = np.memmap(directory / "embeddings.f32", dtype="<f4", mode="r", shape=(count, dimensions))
+        self.norms = np.memmap(directory / "norms.f32", dtype="<f4", mode="r", shape=(count,))
+        self.offsets = np.memmap(directory / "offsets.i64", dtype="<i8", mode="r", shape=(count + 1,))
+        with open(directory / "chunks.jsonl", "rb") as f:
+            self.chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def search(self, query: np.ndarray, k: int) -> List[Document]:
+        """Exact top-k by squared L2 distance, the metric of the Chroma collections"""
+        if self.count == 0:
+            return []
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2; the last term is the same for every row
+        distances = self.norms - 2.0 * (self.embeddings @ query)
+        k = min(k, self.count)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        documents = []
+        for row in top:
+            chunk = json.loads(self.chunks[self.offsets[row]:self.offsets[row + 1]])
+            documents.append(Document(page_content=chunk["document"], metadata=chunk["metadata"] or {}))
+        return documents
+
+
+class _Generation:
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.manifest = json.loads((directory / "manifest.json").read_text(encoding="utf-8"))
+        self.number = self.manifest["generation"]
+        self.collections: Dict[str, _MappedCollection] = {
+            name: _MappedCollection(directory / name, info["count"], info["dimensions"])
+            for name, info in self.manifest["collections"].items()
+        }
+
+
+class SharedIndexReader:
+    """
+    Read-only view of the published index, shared by all serving workers.
+
+    Every worker maps the same generation files, so index memory is paid once
+    per node no matter how many workers run. index_version.json is checked at
+    most every check_interval seconds; when it names a new generation, the next
+    query maps it and swaps it in, with no restart. Queries already running
+    finish on the generation they started with.
+
+    Workers do not open Chroma at all; only the query embedding is computed in
+    the worker (EMBEDDING_BACKEND=onnx-int8 keeps that model small).
+    """
+
+    _readers: Dict[str, "SharedIndexReader"] = {}
+    _readers_lock = threading.Lock()
+
+    def __init__(self, serving_dir: str = "serving", check_interval: float = 1.0):
+        """
+        Args:
+            serving_dir: Directory written by IndexPublisher (default: "serving")
+            check_interval: Minimum seconds between index version checks (default: 1.0)
+        """
+        self.logger = Logger()
+        self.serving_dir = Path(serving_dir)
+        self.check_interval = check_interval
+        self._generation: Optional[_Generation] = None
+        self._version_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._embeddings = None
+
+    @classmethod
+    def shared(cls, serving_dir: str = "serving") -> "SharedIndexReader":
+        """Get the process-wide reader for a serving directory"""
+        with cls._readers_lock:
+            reader = cls._readers.get(serving_dir)
+            if reader is None:
+                reader = cls(serving_dir)
+                cls._readers[serving_dir] = reader
+            return reader
+
+    def refresh(self) -> Optional[_Generation]:
+        """Swap in the generation named by index_version.json if it changed"""
+        now = time.monotonic()
+        if self._generation is not None and now - self._checked_at < self.check_interval:
+            return self._generation
+
+        with self._lock:
+            self._checked_at = now
+            version_path = self.serving_dir / "index_version.json"
+            try:
+                mtime = version_path.stat().st_mtime
+            except FileNotFoundError:
+                return self._generation
+            if mtime == self._version_mtime:
+                return self._generation
+
+            number = json.loads(version_path.read_text(encoding="utf-8"))["generation"]
+            if self._generation is None or self._generation.number != number:
+                generation = _Generation(self.serving_dir / f"gen-{number}")
+                if generation.manifest["embedding_model"] != DEFAULT_MODEL_NAME:
+                    self.logger.log_system("warning",
+                        f"Serving generation {number} was embedded with {generation.manifest['embedding_model']}")
+                self._generation = generation
+                self.logger.log_system("info", f"Serving index generation {number}")
+            self._version_mtime = mtime
+            return self._generation
+
+    @property
+    def generation(self) -> Optional[int]:
+        generation = self.refresh()
+        return generation.number if generation else None
+
+    def similarity_search(self, collection_name: str, query: str, k: int = 4) -> List[Document]:
+        """
+        Search one collection of the current generation
+
+        Args:
+            collection_name: "lab_reports", "prescriptions" or "combined"
+            query: Search query
+            k: Number of documents to return (default: 4)
+
+        Returns:
+            The k nearest chunks, nearest first
+        """
+        if self._embeddings is None:
+            from src.initialize_embeddings import EmbeddingRegistry
+            self._embeddings = EmbeddingRegistry.get()
+        return self.similarity_search_by_vector(collection_name, self._embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, collection_name: str, embedding: List[float], k: int = 4) -> List[Document]:
+        """Search one collection of the current generation with an already computed query embedding"""
+        generation = self.refresh()
+        if generation is None:
+            raise RuntimeError(f"No index has been published to {self.serving_dir}")
+        collection = generation.collections.get(collection_name)
+        if collection is None or collection.count == 0:
+            return []
+        return collection.search(np.asarray(embedding, dtype=np.float32), k)
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.knowledge_base.shared_index [--force]
+    # Syncs the stores with docs/ and publishes them; serving workers never do this themselves
+    from .create_vector_store import VectorStore
+
+    vector_store = VectorStore()
+    vector_store.serving = False
+    vector_store.create_all_stores()
+    generation = IndexPublisher(vector_store).publish(force="--force" in sys.argv)
+    print(f"Published generation {generation}" if generation else "Serving index already up to date")
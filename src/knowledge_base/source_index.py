@@ -0,0 +1,131 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+from src.logging import Logger
+from .sharded_store import ShardedVectorStore
+
+
+def iter_pages(store, include: List[str], page_size: int = 1000) -> Iterator[dict]:
+    """
+    Page through a Chroma or sharded store, reading only the requested fields
+
+    Args:
+        store: Chroma store or ShardedVectorStore
+        include: Fields to read besides ids (e.g. ["metadatas"])
+        page_size: Number of chunks per page (default: 1000)
+
+    Yields:
+        get()-style result dicts of at most page_size chunks
+    """
+    if isinstance(store, ShardedVectorStore):
+        yield from store.iter_pages(include, page_size)
+        return
+    offset = 0
+    while True:
+        page = store.get(include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        yield page
+
+
+def store_count(store) -> int:
+    """Number of chunks in a Chroma or sharded store, without reading them"""
+    if isinstance(store, ShardedVectorStore):
+        return store.count()
+    return store._collection.count()
+
+
+class SourceIndex:
+    """
+    Secondary index of source path -> chunk ids for one collection.
+
+    It is kept in sources.json next to the collection and updated by VectorStore
+    whenever it adds or deletes chunks, so sync and stats can work from it instead
+    of reading every chunk body out of Chroma. Before use it is checked against
+    the collection's chunk count; if the file is missing or out of step (e.g. a
+    crash between a write and save()) it is rebuilt with a paged, metadata-only
+    scan.
+    """
+
+    def __init__(self, index_path: str):
+        """
+        Args:
+            index_path: Path of the JSON index file
+        """
+        self.logger = Logger()
+        self.index_path = Path(index_path)
+        # Chunks without a source are tracked under "" so counts still add up
+        self.chunk_ids: Dict[str, List[str]] = {}
+        self._loaded = False
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.chunk_ids.values())
+
+    def sources(self) -> List[str]:
+        """Indexed source paths"""
+        return [source for source in self.chunk_ids if source]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of chunks per source"""
+        return {source: len(ids) for source, ids in self.chunk_ids.items() if source}
+
+    def ids_for(self, sources: Iterable[str]) -> List[str]:
+        """Chunk ids of the given sources"""
+        return [id_ for source in sources for id_ in self.chunk_ids.get(source, [])]
+
+    def all_ids(self) -> List[str]:
+        return [id_ for ids in self.chunk_ids.values() for id_ in ids]
+
+    def add(self, ids: List[str], sources: List[Optional[str]]):
+        """Record newly written chunks"""
+        for id_, source in zip(ids, sources):
+            self.chunk_ids.setdefault(source or "", []).append(id_)
+
+    def remove_sources(self, sources: Iterable[str]):
+        """Forget all chunks of the given sources"""
+        for source in sources:
+            self.chunk_ids.pop(source, None)
+
+    def clear(self):
+        self.chunk_ids = {}
+
+    def load(self) -> bool:
+        """Load the index from disk; returns False if there is none"""
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.chunk_ids = json.load(f)["sources"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+        self._loaded = True
+        return True
+
+    def save(self):
+        """Write the index to index_path atomically"""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "sources": self.chunk_ids}, f)
+        os.replace(tmp_path, self.index_path)
+        self._loaded = True
+
+    def rebuild(self, store, page_size: int = 1000):
+        """Rebuild the index from the store's metadata, one page at a time"""
+        self.clear()
+        for page in iter_pages(store, ["metadatas"], page_size):
+            self.add(page["ids"], [(meta or {}).get("source") for meta in page["metadatas"]])
+        self.save()
+        self.logger.log_system("info",
+            f"Rebuilt source index {self.index_path}: {len(self.chunk_ids)} sources, {len(self)} chunks")
+
+    def ensure(self, store) -> "SourceIndex":
+        """Make sure the index is loaded and matches the store's chunk count, rebuilding it if not"""
+        if not self._loaded:
+            self.load()
+        count = store_count(store)
+        if len(self) != count:
+            self.logger.log_system("info",
+                f"Source index {self.index_path} has {len(self)} chunks, store has {count}; rebuilding")
+            self.rebuild(store)
+        return self
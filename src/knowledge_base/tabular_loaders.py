@@ -0,0 +1,147 @@
+import csv
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence
+from langchain_core.documents import Document
+from src.logging import Logger
+
+
+class TabularLoader:
+    """
+    Streaming, row-aware loader for spreadsheet and CSV exports.
+
+    Rows are read one at a time (openpyxl read-only mode for XLSX, the csv module
+    for CSV) and grouped into Documents of at most max_chunk_chars characters. A
+    group never ends in the middle of a row, and every group starts with the
+    header row, so each chunk can be understood on its own. Only the group being
+    built is held in memory while reading, instead of a whole DataFrame plus its
+    rendered string.
+
+    Memory is bounded while reading, not for the whole ingestion: load() returns
+    every row group of a file as a list, and Ingestion keeps all documents of a
+    directory until they are deduplicated, indexed for lab results and chunked,
+    each of which needs the complete set. Peak memory therefore still grows with
+    the export (about one copy of its text). load_xlsx/load_csv can be iterated
+    directly by callers that can work one group at a time.
+    """
+
+    def __init__(self, max_chunk_chars: int = 1000, separator: str = " | "):
+        """
+        Args:
+            max_chunk_chars: Target size of each row group in characters (default: 1000,
+                the CreateChunks chunk size, so groups are not split any further)
+            separator: String used to join the cells of a row (default: " | ")
+        """
+        self.logger = Logger()
+        self.max_chunk_chars = max_chunk_chars
+        self.separator = separator
+
+    def _format_row(self, row: Sequence) -> str:
+        return self.separator.join("" if cell is None else str(cell).strip() for cell in row)
+
+    def _group_rows(self, rows: Iterable[Sequence], metadata: dict, first_row: int = 1) -> Iterator[Document]:
+        """
+        Group rows into Documents along row boundaries, repeating the header
+
+        Args:
+            rows: Iterable of rows; the first non-empty row is the header
+            metadata: Metadata copied into every Document (e.g. source, sheet)
+            first_row: 1-based row number of the first row in rows
+
+        Yields:
+            Documents with row_start/row_end metadata (1-based, inclusive)
+        """
+        header: Optional[str] = None
+        lines: List[str] = []
+        size = 0
+        row_start = row_end = None
+
+        for row_number, row in enumerate(rows, first_row):
+            if not any(cell not in (None, "") for cell in row):
+                continue
+            line = self._format_row(row)
+
+            if header is None:
+                header = line
+                continue
+
+            # Close the current group if this row would push it over the limit
+            if lines and size + len(line) + 1 > self.max_chunk_chars:
+                yield Document(
+                    page_content="\n".join([header] + lines),
+                    metadata={**metadata, "row_start": row_start, "row_end": row_end}
+                )
+                lines, size, row_start = [], 0, None
+
+            if row_start is None:
+                row_start = row_number
+                size = len(header)
+            lines.append(line)
+            size += len(line) + 1
+            row_end = row_number
+
+        if lines:
+            yield Document(
+                page_content="\n".join([header] + lines),
+                metadata={**metadata, "row_start": row_start, "row_end": row_end}
+            )
+        elif header is not None:
+            # Header-only sheet: still index the column names
+            yield Document(page_content=header, metadata=dict(metadata))
+
+    def load_xlsx(self, file_path: str) -> Iterator[Document]:
+        """
+        Stream row groups from every sheet of an XLSX workbook
+
+        Args:
+            file_path: Path to the workbook
+
+        Yields:
+            Documents with source, sheet and row range metadata
+        """
+        from openpyxl import load_workbook
+
+        # read_only streams rows from the XML instead of building the whole workbook
+        workbook = load_workbook(filename=str(file_path), read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                metadata = {"source": str(file_path), "sheet": sheet.title}
+                yield from self._group_rows(sheet.iter_rows(values_only=True), metadata)
+        finally:
+            workbook.close()
+
+    def load_csv(self, file_path: str, encoding: str = "utf-8-sig") -> Iterator[Document]:
+        """
+        Stream row groups from a CSV file
+
+        Args:
+            file_path: Path to the CSV file
+            encoding: File encoding (default: "utf-8-sig", which also strips a BOM)
+
+        Yields:
+            Documents with source and row range metadata
+        """
+        with open(file_path, newline="", encoding=encoding, errors="replace") as f:
+            metadata = {"source": str(file_path)}
+            yield from self._group_rows(csv.reader(f), metadata)
+
+    def load(self, file_path: str) -> List[Document]:
+        """
+        Load an XLSX or CSV file into row-grouped Documents
+
+        Args:
+            file_path: Path to the file
+
+        Returns:
+            All row groups of the file (about one copy of its text; no DataFrame or
+            rendered table is built)
+        """
+        file_ext = Path(file_path).suffix.lower()
+        if file_ext == ".xlsx":
+            docs = list(self.load_xlsx(file_path))
+        elif file_ext == ".csv":
+            docs = list(self.load_csv(file_path))
+        else:
+            raise ValueError(f"Unsupported tabular format: {file_ext}. Must be one of: .xlsx, .csv")
+
+        self.logger.log_system("info", f"Grouped rows of {file_path} into {len(docs)} documents")
+        return docs
@@ -0,0 +1,4 @@
+from .import_profile import ImportProfiler
+from .runtime_profile import ProfilingHooks, SamplingProfiler
+
+__all__ = ["ImportProfiler", "ProfilingHooks", "SamplingProfiler"]
\ No newline at end of file
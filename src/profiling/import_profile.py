@@ -0,0 +1,117 @@
+# this file reports where import time goes, using python's -X importtime
+
+import re
+import subprocess
+import sys
+from typing import Dict, List
+from src.logging import Logger
+
+
+# Matches lines like "import time:       123 |      4567 |   torch.nn"
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+class ImportProfiler:
+    """
+    Measures the import cost of a module in a fresh interpreter.
+
+    Each module is imported in a subprocess with `-X importtime`, so the numbers
+    reflect a real cold start and are not skewed by modules already imported by
+    the calling process.
+    """
+
+    def __init__(self, top_n: int = 25):
+        """
+        Args:
+            top_n: Number of slowest imports to include in the report (default: 25)
+        """
+        self.logger = Logger()
+        self.top_n = top_n
+
+    def _run_importtime(self, statement: str) -> subprocess.CompletedProcess:
+        """Run a statement in a fresh interpreter with import timing enabled"""
+        return subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            capture_output=True,
+            text=True
+        )
+
+    def _startup_modules(self) -> set:
+        """Modules the interpreter imports before running any user code"""
+        completed = self._run_importtime("pass")
+        return {
+            match.group(4)
+            for match in map(_IMPORT_TIME_LINE.match, completed.stderr.splitlines())
+            if match
+        }
+
+    def profile(self, module_name: str) -> Dict[str, any]:
+        """
+        Import a module in a subprocess and collect per-module import times
+
+        Args:
+            module_name: Dotted module name to import (e.g. "src.document_vector_retrieval")
+
+        Returns:
+            Dictionary containing:
+            - module: the profiled module
+            - total_ms: import time of the module, excluding interpreter startup
+            - imports: list of (module, self_ms, cumulative_ms) for the top two import
+              levels, slowest first
+        """
+        completed = self._run_importtime(f"import {module_name}")
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "unknown error"
+            self.logger.log_system("error", f"Import profile of {module_name} failed: {error}")
+            raise RuntimeError(f"Failed to import {module_name}: {error}")
+
+        # Interpreter startup (site, encodings, ...) is the same for every module, leave it out
+        startup_modules = self._startup_modules()
+
+        imports: List[tuple] = []
+        total_ms = 0.0
+        for line in completed.stderr.splitlines():
+            match = _IMPORT_TIME_LINE.match(line)
+            if not match or match.group(4) in startup_modules:
+                continue
+            self_us, cumulative_us, indent, name = match.groups()
+            cumulative_ms = int(cumulative_us) / 1000.0
+            # Nesting is shown by two extra spaces per level; keep the top two levels
+            depth = (len(indent) - 1) // 2
+            if depth == 0:
+                total_ms += cumulative_ms
+            if depth <= 1:
+                imports.append((name, int(self_us) / 1000.0, cumulative_ms))
+
+        imports.sort(key=lambda item: item[2], reverse=True)
+        result = {
+            "module": module_name,
+            "total_ms": total_ms,
+            "imports": imports[:self.top_n]
+        }
+        self.logger.log_system("info", f"Import profile of {module_name}: {total_ms:.1f}ms")
+        return result
+
+    def print_report(self, result: Dict[str, any]):
+        """Print an import profile as a table"""
+        print(f"\nImport profile for {result['module']}: {result['total_ms']:.1f}ms total")
+        print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+        for name, self_ms, cumulative_ms in result["imports"]:
+            print(f"{cumulative_ms:>16.1f} {self_ms:>10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.profiling.import_profile [module ...]
+    modules = sys.argv[1:] or [
+        "src",
+        "src.logging",
+        "src.document_vector_retrieval",
+        "src.initialize_llm",
+        "src.knowledge_base.create_vector_store",
+    ]
+    profiler = ImportProfiler()
+    for module in modules:
+        try:
+            profiler.print_report(profiler.profile(module))
+        except RuntimeError as e:
+            print(f"\n{e}")
@@ -0,0 +1,264 @@
+# this file provides opt-in sampling and allocation profiling for live queries and indexing
+
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, Optional
+from src.logging import Logger
+
+
+def _profile_path(directory: Path, name: str, suffix: str) -> Path:
+    """profiles/<name>-<timestamp>-<pid><suffix>, safe to write from several processes"""
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+    return directory / f"{safe_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{suffix}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that samples the Python stacks of all threads.
+
+    A background thread reads sys._current_frames() every interval seconds and
+    counts each distinct stack, so nothing is hooked into the profiled code and
+    the cost is one stack walk per thread per sample. Embedding, OCR and shard
+    requests run in worker threads, so they are included, under their thread
+    name. Native code (torch kernels, tesseract) is attributed to the Python
+    frame that called it.
+
+    Stacks are written in collapsed format ("thread;outer;...;inner count"),
+    which flamegraph.pl, speedscope and inferno read directly.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Args:
+            interval: Seconds between samples (default: 0.005)
+        """
+        self.logger = Logger()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(thread_names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """Start sampling in a background thread"""
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def top_frames(self, top_n: int = 10) -> List[tuple]:
+        """Frames where samples landed most often (self time), as (frame, samples)"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(top_n)
+
+    def write(self, directory: Path, name: str) -> Path:
+        """Write the collapsed stacks to the profiles directory"""
+        directory.mkdir(parents=True, exist_ok=True)
+        path = _profile_path(directory, name, ".collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class ProfilingHooks:
+    """
+    On-demand profiling for the query and indexing paths, off unless asked for.
+
+    - Queries: a SamplingProfiler runs for a PROFILE_REQUESTS fraction of
+      requests (1 = every request), or for a request with the X-Profile header.
+      Any client can send that header, so it is ignored unless the operator
+      sets PROFILE_ALLOW_HEADER=1 or a PROFILE_TOKEN the header must match.
+    - Indexing: with PROFILE_INDEXING=1, store refreshes are sampled and each
+      ingestion batch is wrapped in tracemalloc snapshots.
+
+    Results go to PROFILES_DIR (default: "profiles"): collapsed stacks for
+    flamegraphs and the top allocation sites, with a summary in the system log.
+    When profiling is off each hook only checks a flag and yields.
+    """
+
+    # tracemalloc is process-wide: concurrent trace_allocations() blocks share it,
+    # and it is stopped when the last one exits (if a block started it)
+    _tracing_lock = threading.Lock()
+    _tracers = 0
+    _started_tracing = False
+
+    def __init__(self):
+        self.logger = Logger()
+        self.profiles_dir = Path(os.getenv("PROFILES_DIR", "profiles"))
+        self.request_rate = float(os.getenv("PROFILE_REQUESTS", "0"))
+        self.allow_header = os.getenv("PROFILE_ALLOW_HEADER", "0") == "1"
+        self.token = os.getenv("PROFILE_TOKEN", "")
+        self.indexing = os.getenv("PROFILE_INDEXING", "0") == "1"
+        self.interval = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0
+        self.top_n = int(os.getenv("PROFILE_TOP_N", "25"))
+
+    def request_enabled(self, headers: Optional[Mapping[str, str]] = None) -> bool:
+        """Whether to profile this request"""
+        if headers and self._header_allowed(str(headers.get("X-Profile", ""))):
+            return True
+        return self.request_rate > 0 and random.random() < self.request_rate
+
+    def _header_allowed(self, value: str) -> bool:
+        """Whether an X-Profile header value may turn profiling on"""
+        if not value:
+            return False
+        if self.token:
+            return hmac.compare_digest(value.encode(), self.token.encode())
+        return self.allow_header and value.lower() in ("1", "true", "yes")
+
+    @contextmanager
+    def profile(self, name: str, enabled: bool) -> Iterator[Optional[SamplingProfiler]]:
+        """
+        Sample all threads while the block runs and write the collapsed stacks
+
+        Args:
+            name: Profile name used in the output file name (e.g. "query")
+            enabled: Whether to profile at all; when False this does nothing
+        """
+        if not enabled:
+            yield None
+            return
+
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            try:
+                path = profiler.write(self.profiles_dir, name)
+                hottest = ", ".join(f"{frame} x{count}" for frame, count in profiler.top_frames(5))
+                self.logger.log_system("info",
+                    f"Profiled {name}: {profiler.elapsed:.2f}s, {profiler.samples} samples -> {path}; "
+                    f"hottest: {hottest}")
+            except Exception as e:
+                self.logger.log_system("warning", f"Could not write profile for {name}: {e}")
+
+    @contextmanager
+    def trace_allocations(self, name: str, enabled: Optional[bool] = None) -> Iterator[None]:
+        """
+        Snapshot allocations with tracemalloc around a block and write the top growth sites
+
+        Args:
+            name: Profile name used in the output file name (e.g. "ingest-lab_reports")
+            enabled: Whether to trace (default: PROFILE_INDEXING)
+        """
+        if not (self.indexing if enabled is None else enabled):
+            yield
+            return
+
+        self._acquire_tracing()
+        try:
+            before = tracemalloc.take_snapshot()
+        except Exception as e:
+            self.logger.log_system("warning", f"Could not snapshot allocations for {name}: {e}")
+            before = None
+        try:
+            yield
+        finally:
+            # A profiling failure must never fail (or change the result of) the traced block
+            try:
+                if before is not None:
+                    after = tracemalloc.take_snapshot()
+                    _, peak = tracemalloc.get_traced_memory()
+                    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                               tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+                    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+                    self._write_allocations(name, stats, peak)
+            except Exception as e:
+                self.logger.log_system("warning", f"Could not write allocation profile for {name}: {e}")
+            finally:
+                self._release_tracing()
+
+    @classmethod
+    def _acquire_tracing(cls):
+        with cls._tracing_lock:
+            if cls._tracers == 0:
+                cls._started_tracing = not tracemalloc.is_tracing()
+                if cls._started_tracing:
+                    tracemalloc.start(25)
+                # Only the first tracer resets the peak; overlapping blocks report a shared peak
+                tracemalloc.reset_peak()
+            cls._tracers += 1
+
+    @classmethod
+    def _release_tracing(cls):
+        with cls._tracing_lock:
+            cls._tracers -= 1
+            if cls._tracers == 0 and cls._started_tracing:
+                tracemalloc.stop()
+                cls._started_tracing = False
+
+    def _write_allocations(self, name: str, stats: list, peak: int):
+        self.profiles_dir.mkdir(parents=True, exist_ok=True)
+        path = _profile_path(self.profiles_dir, name, ".alloc.txt")
+        growth = sum(stat.size_diff for stat in stats)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# {name}: net {growth / 1e6:+.1f}MB, peak traced {peak / 1e6:.1f}MB\n")
+            f.write(f"# {'size diff':>12} {'size':>12} {'count diff':>10}  site\n")
+            for stat in stats[:self.top_n]:
+                frame = stat.traceback[0]
+                f.write(f"{stat.size_diff / 1e3:>10.1f}KB {stat.size / 1e3:>10.1f}KB "
+                        f"{stat.count_diff:>10}  {frame.filename}:{frame.lineno}\n")
+        self.logger.log_system("info",
+            f"Allocation profile of {name}: net {growth / 1e6:+.1f}MB, peak {peak / 1e6:.1f}MB -> {path}")
+
+
+if __name__ == "__main__":
+    # Example: sample a small busy loop and trace an allocation-heavy block
+    hooks = ProfilingHooks()
+    with hooks.profile("example", enabled=True) as profiler:
+        total = sum(i * i for i in range(2_000_000))
+    for frame, count in profiler.top_frames():
+        print(f"{count:>6}  {frame}")
+    with hooks.trace_allocations("example", enabled=True):
+        blocks = [bytearray(1024) for _ in range(10_000)]
+    print(f"Profiles written to {hooks.profiles_dir}/")